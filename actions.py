@@ -1,11 +1,122 @@
 from assembla.error import AssemblaError
-from assembla.models import Ticket
+from assembla.models import Ticket, TicketAssociation
+from assembla.tracing import traced
+from assembla.websession import WebSession
+from assembla.workers import pool_for, spawn
 import logging
 import re
 from copy import deepcopy
 
 logger = logging.getLogger('ATMT')
 
+# Largest page size accepted by the ticket listing
+TICKETS_PER_PAGE = 100
+# Ticket listing report including closed tickets
+ALL_TICKETS_REPORT = 0
+# Tickets kept from the numbers pass for the copy, others are fetched again
+HELD_TICKETS = 2000
+
+class SourceTickets(object):
+    """
+    Source space tickets. The numbers pass finds which tickets of the
+    selection exist before anything is written and indexes them by number
+    and id for the later steps. Up to `hold` of the tickets it fetched are
+    kept for the copy, the rest are fetched again while they are copied so
+    memory stays bounded for huge spaces.
+    """
+
+    def __init__(self, space, hold=HELD_TICKETS):
+        self.space = space
+        self.hold = hold
+        self.held = {}
+        # number <-> id of every ticket the numbers pass found
+        self.ids = {}
+        self.numbers_by_id = {}
+
+    def listing(self, until=None):
+        """
+        Tickets in number order. With `until` the listing stops at the
+        first ticket past that number, if the order was kept so far.
+        """
+        # None once the listing turns out not to be in number order
+        last = 0
+        for t in self.space.iter_tickets(per_page=TICKETS_PER_PAGE,
+                report=ALL_TICKETS_REPORT, sort_by='number',
+                sort_order='asc'):
+            if last is not None and t.number <= last:
+                last = None
+            if until is not None and last and last <= until < t.number:
+                return
+            if last is not None:
+                last = t.number
+            yield t
+
+    def numbers(self):
+        """Sorted numbers of every ticket"""
+        return sorted([t.number for t in self.listing()])
+
+    def fetch(self, numbers):
+        """
+        Yield the tickets of `numbers` that exist, missing ones are logged.
+        Listing in number order up to the highest wanted number takes a
+        request per page of the space below it, tickets are requested one
+        by one when that is fewer requests.
+        """
+        wanted = set(numbers)
+        if not wanted:
+            return
+        pages = -(-max(wanted) // TICKETS_PER_PAGE)
+        if len(wanted) <= pages:
+            for n in sorted(wanted):
+                try:
+                    t = self.space.get_ticket(n)
+                except AssemblaError, e:
+                    if getattr(e.response, 'status_code', None) != 404:
+                        raise
+                    continue
+                wanted.discard(n)
+                yield t
+        else:
+            logger.debug('[SourceTickets] Streaming ticket list of %s',
+                    self.space.name)
+            for t in self.listing(until=max(wanted)):
+                if t.number in wanted:
+                    wanted.discard(t.number)
+                    yield t
+                    if not wanted:
+                        break
+        if wanted:
+            logger.debug('[SourceTickets] %s tickets not found in %s: %s',
+                    len(wanted), self.space.name,
+                    ', '.join([str(n) for n in sorted(wanted)]))
+
+    def find(self, numbers=None):
+        """
+        Numbers pass: index the tickets in `numbers` (every ticket when
+        None) that exist, return their sorted numbers
+        """
+        tickets = self.listing() if numbers is None else self.fetch(numbers)
+        for t in tickets:
+            self.ids[t.number] = t.id
+            self.numbers_by_id[t.id] = t.number
+            if len(self.held) < self.hold:
+                self.held[t.number] = t
+        return sorted(self.ids)
+
+    def iter(self, numbers):
+        """Yield the tickets of `numbers`, those held by find() first"""
+        rest = []
+        for n in numbers:
+            t = self.held.pop(n, None)
+            if t is None:
+                rest.append(n)
+            else:
+                yield t
+        if rest:
+            for t in self.fetch(rest):
+                yield t
+
+
 def prettify(changes):
     if isinstance(changes,str) or isinstance(changes,unicode):
         changes = changes.replace('---','*Emulated Ticket Change*', 1)
@@ -87,7 +198,7 @@ def copy_ticket_components(space1, space2):
 
 def copy_milestones(space1, space2):
     logger.debug('[Milestone] Starting')
-    milestones1 = space1.get_milestones()
+    milestones1 = space1.iter_milestones()
     milestones2 = space2.get_milestones()
     existing_ms_map={}
     for m in milestones2:
@@ -108,45 +219,57 @@ def copy_milestones(space1, space2):
     # Ticket milestone IDs may differ, return a mapping for new milestones
     return mapping
 
-def copy_document(file_id, ticket1, ticket2, auth=None):
+def web_session(auth):
+    # auth is either (username, password) or an already shared WebSession
+    if isinstance(auth, WebSession):
+        return auth
+    return WebSession(*auth)
+
+@traced(args=lambda file_id, *a, **k: {'document': file_id})
+def copy_document(file_id, ticket1, ticket2, auth=None, journal=None):
     logger.debug('[Document] Starting')
     if not auth:
         return
-    from lxml.html import fromstring, submit_form
-    import requests
+    # the same document may be attached to several tickets
+    key = '%s:%s' % (ticket2.id, file_id)
+    if journal and journal.done('document', key):
+        logger.debug('[Document] Skipping %s, already attached', file_id)
+        return
     try:
         olddoc = ticket1.get_document(file_id)
     except AssemblaError:
         logger.debug('[Document] not found (probably deleted) %s', file_id)
         return
-    login_url = 'https://www.assembla.com/do_login'
-    client = requests.session()
-    login_form = fromstring(client.get(login_url).content).forms[0]
-    login_form.fields['user[login]'] = auth[0]
-    login_form.fields['user[password]'] = auth[1]
-    login_response = submit_form(login_form, open_http=client.request)
-    if login_response.status_code != 200:
-        raise AssemblaError('Failed on file download, status: %s' % login_response.status_code, response=login_response.content)
-    response=client.get(olddoc.url)
+    # streamed straight into the upload, never held in memory as a whole,
+    # and opened again when the upload is retried
+    session = web_session(auth)
     logger.debug('[Document] Attaching %s', olddoc.name)
     try:
-        newdoc=ticket2.attach_file(response, olddoc)
+        newdoc=ticket2.attach_file(lambda: session.open_document(olddoc),
+                olddoc)
     except AssemblaError, e:
-        logger.debug('[Document] AssemblaError body:\n\n%s\n', e.response.content)
+        logger.debug('[Document] AssemblaError body:\n\n%s\n', getattr(e.response, 'content', None))
         logger.debug('[Document] Failed to attach source document: %s', olddoc.id)
     else:
         logger.debug('[Document] Attached with new id: %s', newdoc.id)
+        if journal:
+            journal.record('document', key, newdoc.id)
         logger.debug('[Document] Finished')
 
-def copy_ticket_comments(ticket1, ticket2, number_map, auth=None):
+@traced(args=lambda ticket1, *a, **k: {'ticket': ticket1.number})
+def copy_ticket_comments(ticket1, ticket2, number_map, auth=None,
+        journal=None):
     logger.debug('[TicketComment] Starting')
-    comments = ticket1.get_comments()
-    for c in comments:
+    for c in ticket1.iter_comments():
+        if journal and journal.done('comment', c.id):
+            logger.debug('[TicketComment] Skipping %s, already copied', c.id)
+            continue
         try:
             c_text = getattr(c, 'comment', None)
             if c.file:
                 if auth: # allows for downloading files from www.assembla.com
-                    copy_document(c.file, ticket1, ticket2, auth)
+                    copy_document(c.file, ticket1, ticket2, auth, journal)
+                continue
             else:
                 if c_text and c.comment:
                     c.comment = remap_references(c.comment, number_map)
@@ -163,11 +286,29 @@ def copy_ticket_comments(ticket1, ticket2, number_map, auth=None):
             logger.debug('[TicketComment] Failed to process %s', c.id)
             logger.debug('[TicketComment] Response:\n\n%s\n', e.response.content)
             continue
+        if journal:
+            journal.record('comment', c.id, cnew.id)
     logger.debug('[TicketComment] Finished')
 
+def resume_ticket(space2, created):
+    # Ticket created by an earlier run, rebuild it without querying the API
+    ticket2 = Ticket(api=space2._api)
+    ticket2.id, ticket2.number = created
+    ticket2.space_id = space2.id
+    return ticket2
+
+@traced(args=lambda ticket1, *a, **k: {'ticket': ticket1.number})
 def copy_ticket(ticket1, space2, component_map, milestone_map,
-        number_map, auth=None):
+        number_map, auth=None, journal=None):
     logger.debug('[Ticket] Starting')
+    created = journal.get('ticket', ticket1.number) if journal else None
+    if created:
+        ticket2 = resume_ticket(space2, created[1:])
+        logger.debug('[Ticket] Resuming ticket number %s', ticket2.number)
+        copy_ticket_comments(ticket1, ticket2, number_map, auth, journal)
+        journal.record('ticket_done', ticket1.number)
+        logger.debug('[Ticket] Finished')
+        return ticket2
     tcopy = deepcopy(ticket1)
     if tcopy.milestone_id:
         tcopy.milestone_id = milestone_map[tcopy.milestone_id]
@@ -181,127 +322,259 @@ def copy_ticket(ticket1, space2, component_map, milestone_map,
         ticket2 = space2.create_ticket(tcopy)
     except AssemblaError, e:
         logger.debug("[Ticket] Error from Assembla:\n\n%s\n", e.response.content)
-        logger.debug("[Ticket] Failed to copy source ticket %s", ticket2.number)
+        logger.debug("[Ticket] Failed to copy source ticket %s", ticket1.number)
         raise e
     else:
         logger.debug('[Ticket] Created with id %s', ticket2.id)
-        copy_ticket_comments(ticket1, ticket2, number_map, auth)
+        if journal:
+            journal.record('ticket', ticket1.number,
+                    [ticket1.id, ticket2.id, ticket2.number])
+        copy_ticket_comments(ticket1, ticket2, number_map, auth, journal)
+        if journal:
+            journal.record('ticket_done', ticket1.number)
         logger.debug('[Ticket] Finished')
     return ticket2
 
-def check_association_ambivalent(a1, a2, id_map):
-    r = False
-    if id_map[a1.ticket1_id] == a2.ticket1_id and id_map[a1.ticket2_id] == a2.ticket2_id:
-        r = True
-    elif id_map[a1.ticket2_id] == a2.ticket1_id and id_map[a1.ticket1_id] == a2.ticket2_id:
-        r = True
-    return r
-
+def association_edge(association, id_map=None):
+    # Undirected edge key, the lowest ticket id always comes first
+    a, b = association.ticket1_id, association.ticket2_id
+    relationship = association.relationship
+    if id_map:
+        a, b = id_map[a], id_map[b]
+    if a > b:
+        a, b = b, a
+        relationship = TicketAssociation.INVERSE.get(relationship, relationship)
+    return (a, b, relationship)
 
-def copy_ticket_associations(space1, space2, id_map, number_map):
-    logger.debug('[TicketAssociation] Starting')
-    for n in number_map:
-        t2 = space2.get_ticket(number_map[n])
-        logger.debug('[TicketAssociation] Processing %s', t2.id)
-        t1 = space1.get_ticket(n)
-        for ass1 in t1.get_associations():
+def get_association_edges(space, numbers, pool, id_map=None):
+    edges = set()
+    for n, result in pool.imap(space.get_associations, numbers):
+        for ass in result.result():
             # skip if associated ticket not copied
-            if ass1.ticket1_id not in id_map or \
-                    ass1.ticket2_id not in id_map:
-                logger.debug('[TicketAssociation] Skipping %s', ass1.id)
-                continue
-            # skip if association already exists
-            exists = False
-            for ass2 in t2.get_associations():
-                exists = check_association_ambivalent(ass1, ass2, id_map)
-            if exists:
-                logger.debug('[TicketAssociation] Skipping %s', ass1.id)
+            if id_map is not None and (ass.ticket1_id not in id_map or
+                    ass.ticket2_id not in id_map):
+                logger.debug('[TicketAssociation] Skipping %s', ass.id)
                 continue
+            edges.add(association_edge(ass, id_map))
+    return edges
+
+@traced()
+def copy_ticket_associations(space1, space2, id_map, number_map,
+        id_number_map, journal=None, concurrency=1, pool=None, source=None):
+    logger.debug('[TicketAssociation] Starting')
+    numbers = [n for n in sorted(number_map)
+            if not (journal and journal.done('associations', n))]
+    if source is not None:
+        # associations of tickets that failed to copy are all skipped
+        numbers = [n for n in numbers
+                if n not in source.ids or source.ids[n] in id_map]
+    with pool_for(concurrency, pool) as pool:
+        edges = get_association_edges(space1, numbers, pool, id_map)
+        if journal:
+            edges = set([e for e in edges
+                    if not journal.done('association', '%s:%s:%s' % e)])
+        # skip associations already in the destination
+        ends = set([id_number_map[i] for e in edges for i in e[:2]])
+        existing = get_association_edges(space2, sorted(ends), pool)
+        logger.debug('[TicketAssociation] %s associations, %s already exist',
+                len(edges), len(edges & existing))
+        edges = sorted(edges - existing)
+
+        def create(edge):
+            association = TicketAssociation(space2._api)
+            association.ticket1_id, association.ticket2_id, \
+                    association.relationship = edge
+            # the API expects the ticket associated from as ticket1
+            return space2.create_association(id_number_map[edge[0]],
+                    association)
 
-            ass_t2_id = ass1.ticket2_id
-            ass1.ticket1_id = id_map[ass1.ticket1_id]
-            ass1.ticket2_id = id_map[ass1.ticket2_id]
-            # fix API glitch
-            if t2.id == id_map[ass_t2_id]:
-                ass1.invert()
-            logger.debug('[TicketAssociation] Associating %s - %s',
-                    ass1.ticket1_id, ass1.ticket2_id)
-            t2.create_association(ass1)
-            logger.debug('[TicketAssociation] Associated')
+        failed = False
+        for edge, result in pool.imap(create, edges):
+            try:
+                result.result()
+            except AssemblaError, e:
+                logger.debug('[TicketAssociation] Failed %s - %s, Response:\n\n%s',
+                        edge[0], edge[1], getattr(e.response, 'content', None))
+                failed = True
+                continue
+            logger.debug('[TicketAssociation] Associated %s - %s',
+                    edge[0], edge[1])
+            if journal:
+                journal.record('association', '%s:%s:%s' % edge)
+    if journal and not failed:
+        for n in numbers:
+            journal.record('associations', n)
     logger.debug('[TicketAssociation] Finished')
 
-def prepare_space_fields(space1, space2):
+@traced()
+def prepare_space_fields(space1, space2, journal=None):
     logger.debug('[Migration] Preparing space')
+    if journal and journal.done('map', 'milestone_map'):
+        logger.debug('[Migration] Space already prepared, using journal')
+        return (journal.get_map('component_map'),
+                journal.get_map('milestone_map'))
     copy_ticket_statuses(space1, space2)
     copy_ticket_custom_fields(space1, space2)
     component_map = copy_ticket_components(space1, space2)
     milestone_map = copy_milestones(space1, space2)
+    if journal:
+        journal.record_map('component_map', component_map)
+        journal.record_map('milestone_map', milestone_map)
     logger.debug('[Migration] Finished preparing space')
     return (component_map, milestone_map)
 
-def check_ticket_numbers(space1, space2, ticket_numbers, renumber=False):
+def get_ticket_numbers(space):
+    # One paginated listing instead of probing every number
+    numbers = frozenset(SourceTickets(space).numbers())
+    logger.debug('[TicketNumbers] %s has %s tickets', space.name, len(numbers))
+    return numbers
+
+@traced()
+def check_ticket_numbers(space1, space2, ticket_numbers, renumber=False,
+        source=None):
     logger.debug('[TicketNumbers] Starting sanity check (may take a while)')
-    tickets = []
-    if ticket_numbers:
-        for n in ticket_numbers:
-            tickets.append(space1.get_ticket(n))
-    else:
-        tickets = space1.get_tickets()
+    source = source or SourceTickets(space1)
+    # missing tickets are left out before anything is written
+    numbers = source.find(ticket_numbers or None)
     if not renumber:
-        for t in tickets:
-            logger.debug('[TicketNumbers] Checking ticket %s' % t.number)
-            try:
-                t2 = space2.get_ticket(t.number)
-                if t2:
-                    logger.debug('[TicketNumbers] Ticket %s exists' % t.number)
-                    return None, None
-            except AssemblaError, e:
-                if not e.reason.startswith("Couldn't find Ticket"):
-                    raise e
-        else:
-            logger.debug('[TicketNumbers] Finished sanity check')
-            return tickets, dict(zip(ticket_numbers, ticket_numbers))
+        conflicts = sorted(get_ticket_numbers(space2).intersection(numbers))
+        if conflicts:
+            logger.debug('[TicketNumbers] %s tickets exist in %s: %s',
+                    len(conflicts), space2.name,
+                    ', '.join([str(n) for n in conflicts]))
+            return None
+        logger.debug('[TicketNumbers] Finished sanity check')
+        return dict(zip(numbers, numbers))
     temp_ticket = Ticket(api=space2._api)
     temp_ticket.summary="ATMT test ticket to get new ticket number"
     temp_ticket = space2.create_ticket(temp_ticket)
     start = temp_ticket.number
-    end = start+len(tickets)
-    ticket_number_map = dict(zip([t.number for t in tickets], range(start,end)))
+    end = start+len(numbers)
+    ticket_number_map = dict(zip(numbers, range(start,end)))
     space2.delete_ticket(temp_ticket)
     logger.debug('[TicketNumbers] Finished sanity check')
-    return tickets, ticket_number_map
+    return ticket_number_map
+
+def pending_tickets(source, number_map, journal=None):
+    # Only tickets not finished by an earlier run are fetched again
+    numbers = [n for n in sorted(number_map)
+            if not (journal and journal.done('ticket_done', n))]
+    if len(numbers) < len(number_map):
+        logger.debug('[Migration] Resuming, %s of %s tickets left',
+                len(numbers), len(number_map))
+    return source.iter(numbers)
 
+@traced()
 def copy_tickets(tickets, space1, space2, component_map, milestone_map,
-        number_map, auth=None):
+        number_map, auth=None, concurrency=1, journal=None, pool=None):
     logger.debug('[Migration] Starting Ticket copy from %s to %s',
             space1.name, space2.name)
     ticket_id_map = {}
     failed_tickets = []
     new_tickets_id_number_map = {}
-    for t in tickets:
-        try:
-            ticket2 = copy_ticket(t, space2, component_map, milestone_map, number_map, auth=auth)
-        except AssemblaError, e:
-            logger.debug("[Migration] Error on ticket %s, Response:\n\n%s", t.number, e.response.content)
-            failed_tickets.append(t)
-        else:
-            ticket_id_map[t.id] = ticket2.id
-            new_tickets_id_number_map[ticket2.id] = ticket2.number
-    logger.debug('[Migration] Failed tickets (from source space): %s', ', '.join([t.number for t in failed_tickets]))
+    if journal:
+        for n, (old_id, new_id, new_number) in journal.items('ticket'):
+            if int(n) in number_map:
+                ticket_id_map[old_id] = new_id
+                new_tickets_id_number_map[new_id] = new_number
+
+    # Each ticket (and all of its comments) is copied by a single worker,
+    # results are collected in source order so maps match the serial run.
+    def copy(t):
+        return copy_ticket(t, space2, component_map, milestone_map,
+                number_map, auth=auth, journal=journal)
+
+    with pool_for(concurrency, pool) as pool:
+        for t, result in pool.imap(copy, tickets):
+            try:
+                ticket2 = result.result()
+            except AssemblaError, e:
+                logger.debug("[Migration] Error on ticket %s, Response:\n\n%s",
+                        t.number, getattr(e.response, 'content', None))
+                failed_tickets.append(t)
+            else:
+                ticket_id_map[t.id] = ticket2.id
+                new_tickets_id_number_map[ticket2.id] = ticket2.number
+    logger.debug('[Migration] Failed tickets (from source space): %s',
+            ', '.join([str(t.number) for t in failed_tickets]))
     logger.debug('[Migration] Finished Ticket copy')
-    return ticket_id_map
+    return ticket_id_map, failed_tickets, new_tickets_id_number_map
 
+@traced()
 def migrate_tickets(space1, space2, ticket_numbers=None, auth=None,
-        renumber=False):
+        renumber=False, concurrency=1, journal=None, pool=None):
     logger.debug('[Migration] Starting')
-    component_map, milestone_map = prepare_space_fields(space1, space2)
-    tickets, number_map = check_ticket_numbers(space1, space2, ticket_numbers,
-            renumber=renumber)
-    if tickets == None:
-        logger.debug('[Migration] Ticket numbers failed sanity check, exiting')
-        return None
-    ticket_id_map = copy_tickets(tickets, space1, space2, component_map,
-            milestone_map, number_map, auth=auth)
-    copy_ticket_associations(space1, space2, ticket_id_map, number_map)
+    if journal:
+        # a different selection must not reuse the recorded number map
+        journal.check_options(renumber=bool(renumber),
+                tickets=sorted(set(ticket_numbers))
+                if ticket_numbers is not None else 'all')
+    if pool is not None:
+        concurrency = pool.size
+    if auth:
+        auth = web_session(auth)
+        auth.resize_pool(concurrency)
+    for api in set([space1._api, space2._api]):
+        # one pooled connection per worker
+        api.client.resize_pool(concurrency)
+    component_map, milestone_map = prepare_space_fields(space1, space2,
+            journal)
+    source = SourceTickets(space1)
+    number_map = journal.get_map('number_map') if journal else None
+    if number_map is None:
+        number_map = check_ticket_numbers(space1, space2, ticket_numbers,
+                renumber=renumber, source=source)
+        if number_map == None:
+            logger.debug('[Migration] Ticket numbers failed sanity check, exiting')
+            return None
+        if journal:
+            journal.record_map('number_map', number_map)
+    # tickets are copied as their page of the listing arrives
+    tickets = pending_tickets(source, number_map, journal)
+    ticket_id_map, failed_tickets, id_number_map = copy_tickets(tickets, space1, space2,
+            component_map, milestone_map, number_map, auth=auth,
+            concurrency=concurrency, journal=journal, pool=pool)
+    copy_ticket_associations(space1, space2, ticket_id_map, number_map,
+            id_number_map, journal, concurrency, pool, source)
+    log_pool_stats(space1, space2, auth)
+    log_metrics(space1, space2)
     logger.debug('[Migration] Finished')
     return number_map
+
+def log_pool_stats(space1, space2, auth=None):
+    clients = [('API', api.client) for api in set([space1._api, space2._api])]
+    if auth:
+        clients.append(('Web', auth))
+    for name, client in clients:
+        for host, stats in client.pool_stats().items():
+            logger.debug('[Connections] %s %s: %s requests, %s new '
+                    'connections, %s reused', name, host, stats['requests'],
+                    stats['new'], stats['reused'])
+    for api in set([space1._api, space2._api]):
+        if getattr(api, 'coalescer', None):
+            logger.debug('[Connections] %s GETs sent, %s coalesced',
+                    api.coalescer.executed, api.coalescer.coalesced)
+
+def log_metrics(space1, space2):
+    registries = set([api.client.metrics for api in
+            set([space1._api, space2._api])])
+    for metrics in registries:
+        for endpoint, e in sorted(metrics.summary().items()):
+            logger.debug('[Metrics] %s: %s calls, %s retries, p50 %.0f ms, '
+                    'p99 %.0f ms, %s bytes sent, %s received, %.2f s parsing',
+                    endpoint, e['calls'], e['retries'],
+                    e.get('call_p50', 0) * 1000, e.get('call_p99', 0) * 1000,
+                    e['sent_bytes'], e['received_bytes'],
+                    e.get('parse_seconds', 0))
+
+def migrate_tickets_async(space1, space2, ticket_numbers=None, auth=None,
+        renumber=False, concurrency=8, journal=None, pool=None):
+    """
+    Start migrate_tickets in the background, return a Future for its number
+    map. Each migration copies on a pool of its own, `concurrency` threads
+    unless a `pool` is given, so requests in flight are bounded by the
+    threads of the pools running.
+    """
+    return spawn(migrate_tickets, space1, space2,
+            ticket_numbers=ticket_numbers, auth=auth, renumber=renumber,
+            concurrency=concurrency, journal=journal, pool=pool)
@@ -1,18 +1,104 @@
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.poolmanager import PoolManager
 
 from rauth.service import OAuth2Service
 from assembla.error import AssemblaError
+from assembla.ratelimit import RateLimiter, parse_retry_after, backoff
+from assembla.metrics import REGISTRY
+from assembla.tracing import TRACER
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping `maxsize` connections per host, with `block` set
+    callers wait for a free connection instead of opening extra ones
+    that are thrown away after use.
+    """
+
+    def __init__(self, connections=4, maxsize=10, block=False):
+        self.block = block
+        HTTPAdapter.__init__(self, connections, maxsize)
+
+    def init_poolmanager(self, connections, maxsize):
+        self.poolmanager = PoolManager(num_pools=connections,
+                maxsize=maxsize, block=self.block)
+
+
+def mount_pool(session, connections=4, maxsize=10, block=False):
+    adapter = PooledAdapter(connections, maxsize, block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
+
+
+def pool_stats(session):
+    """Connections opened and requests sent per host by a session"""
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = '%s://%s:%s' % key
+            s = stats.setdefault(host, {'new': 0, 'reused': 0, 'requests': 0})
+            s['new'] += pool.num_connections
+            s['requests'] += pool.num_requests
+            s['reused'] += max(0, pool.num_requests - pool.num_connections)
+    return stats
+
+
+def discard(response):
+    """
+    Release the connection of a streamed response. requests puts it back
+    in the pool as is, so an unread body would be taken as the answer to
+    the next request: small bodies are read, otherwise it is closed.
+    """
+    if not getattr(response, '_content_consumed', True):
+        size = response.headers.get('content-length')
+        if size is not None and size.isdigit() and int(size) <= 65536:
+            response.content
+        else:
+            connection = getattr(response.raw, '_connection', None)
+            if connection is not None:
+                connection.close()
+    response.close()
+
+
+def body_size(data):
+    """Bytes in a request body, 0 when unknown"""
+    if data is None:
+        return 0
+    if isinstance(data, basestring):
+        return len(data)
+    return getattr(data, 'len', 0)
+
+
+def response_size(resp, stream):
+    # streamed bodies are not read yet, trust the header
+    if stream:
+        try:
+            return int(resp.headers.get('content-length') or 0)
+        except ValueError:
+            return 0
+    return len(resp.content or '')
 
 
 class HttpClient(object):
 
     RETRY_CODES = [502, 503, 504]
+    THROTTLED_CODES = [429]
     UNAUTHED_CODES = [401]
     OKAY_STATUS = [200, 201]
+    # refresh tokens this many seconds before they expire
+    REFRESH_MARGIN = 60
 
     def __init__(self, consumer_key, consumer_secret, pin=None,
-            retry_count=3, retry_delay=3, retry_errors=None):
+            retry_count=3, retry_delay=3, retry_errors=None,
+            rate_limit=None, burst=None, pool_connections=4,
+            pool_maxsize=10, pool_block=False, timeout=None, keep_alive=True,
+            metrics=None):
         self.service = OAuth2Service(
             name='assembla',
             authorize_url='https://api.assembla.com/authorization',
@@ -25,6 +111,19 @@ class HttpClient(object):
         self.retry_count = retry_count
         self.retry_delay = retry_delay
         self.retry_errors = retry_errors or self.RETRY_CODES
+        # requests per second shared by every thread, None for no pacing
+        self.limiter = RateLimiter(rate_limit, burst)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.metrics = metrics or REGISTRY
+        # serializes token refreshes between worker threads
+        self.lock = threading.RLock()
+        self.client = None
+        self.access_token = None
+        self.expires_at = None
         if pin:
             self.initClient(pin)
 
@@ -37,23 +136,63 @@ class HttpClient(object):
             redirect_uri="")
         response = self.service.get_access_token("POST", data=data)
         self.initTokens(response.content["access_token"],
-                        response.content["refresh_token"])
-
-    def initTokens(self, access_token, refresh_token):
-        self.service.access_token = access_token
-        self.access_token = access_token
-        self.refresh_token = refresh_token
-        self.client = requests.Session()
-        self.client.stream = False
-        self.client.headers.update({"Authorization": 'Bearer %s'%access_token})
-
-    def refreshTokens(self):
-        data = dict(
-            grant_type="refresh_token",
-            refresh_token=self.refresh_token)
-        response = self.service.get_access_token("POST", data=data)
-        self.initTokens(response.content["access_token"],
-                        self.refresh_token)
+                        response.content["refresh_token"],
+                        response.content.get("expires_in"))
+
+    def initTokens(self, access_token, refresh_token, expires_in=None):
+        with self.lock:
+            self.service.access_token = access_token
+            self.access_token = access_token
+            self.refresh_token = refresh_token
+            if expires_in:
+                self.expires_at = time.time() + float(expires_in)
+            else:
+                self.expires_at = None
+            # keep the session (and its pooled connections) across refreshes
+            if self.client is None:
+                self.client = requests.Session()
+                self.client.stream = False
+                mount_pool(self.client, self.pool_connections,
+                        self.pool_maxsize, self.pool_block)
+                if not self.keep_alive:
+                    self.client.headers['Connection'] = 'close'
+            self.client.headers.update({"Authorization": 'Bearer %s'%access_token})
+
+    def refreshTokens(self, seen=None):
+        """
+        Get a new access token. When `seen` (the token a failed request
+        used) was already replaced by another thread nothing is done,
+        so concurrent 401s cause a single refresh.
+        """
+        with self.lock:
+            if seen is not None and seen != self.access_token:
+                return
+            data = dict(
+                grant_type="refresh_token",
+                refresh_token=self.refresh_token)
+            response = self.service.get_access_token("POST", data=data)
+            self.initTokens(response.content["access_token"],
+                            response.content.get("refresh_token") or self.refresh_token,
+                            response.content.get("expires_in"))
+
+    def resize_pool(self, maxsize):
+        """Grow the per host connection pool, e.g. to the worker count"""
+        with self.lock:
+            if maxsize <= self.pool_maxsize:
+                return
+            self.pool_maxsize = maxsize
+            if self.client is not None:
+                mount_pool(self.client, self.pool_connections,
+                        self.pool_maxsize, self.pool_block)
+
+    def pool_stats(self):
+        if self.client is None:
+            return {}
+        return pool_stats(self.client)
+
+    def expiring(self):
+        return self.expires_at is not None and \
+                time.time() > self.expires_at - self.REFRESH_MARGIN
 
     def GET(self, url, **kargs):
         r=self.retry('get', url, **kargs)
@@ -75,25 +214,87 @@ class HttpClient(object):
         # Continue attempting request until successful
         # or maximum number of retries is reached.
         retries_performed = 0
-        while retries_performed <= self.retry_count:
+        # per request overrides of the client's settings
+        retry_count = kargs.pop('retry_count', None)
+        if retry_count is None:
+            retry_count = self.retry_count
+        retry_delay = kargs.pop('retry_delay', None)
+        if retry_delay is None:
+            retry_delay = self.retry_delay
+        retry_errors = kargs.pop('retry_errors', None) or self.retry_errors
+        # streamed bodies are consumed by an attempt, unless they can be
+        # rewound (a MultipartEncoder reopening its file) they are sent once
+        rewind = getattr(kargs.get('data'), 'rewind', None)
+        replayable = rewind is not None or \
+                not hasattr(kargs.get('data'), 'read')
+        # metrics are labelled by endpoint template, not by url
+        labels = {'method': method.upper(),
+                'endpoint': kargs.pop('endpoint', None) or 'other'}
+        sent = body_size(kargs.get('data'))
+        while retries_performed <= retry_count:
+            # Refresh ahead of expiry rather than after a 401
+            token = self.access_token
+            if self.expiring():
+                self.refreshTokens(token)
+                token = self.access_token
             m=getattr(self.client, method)
+            kargs['headers'] = dict(kargs.get('headers') or {})
+            kargs['headers']['Authorization'] = 'Bearer %s' % token
+            if self.timeout is not None:
+                kargs.setdefault('timeout', self.timeout)
 
             # Execute request
+            self.limiter.acquire()
+            start = time.time()
             try:
                 resp = m(url, **kargs)
             except Exception, e:
+                self.record(labels, 'error', start, sent, 0)
                 raise AssemblaError('Failed to send request: %s' % e)
+            self.record(labels, resp.status_code, start, sent,
+                    response_size(resp, kargs.get('stream')))
+            self.limiter.update(resp.headers)
+            retry_after = parse_retry_after(resp.headers.get('retry-after'))
 
             # If unauthenticated try to refresh Access Token
             if resp.status_code in self.UNAUTHED_CODES:
-                self.refreshTokens()
+                self.refreshTokens(token)
+                retry_after = 0
+            # Slow down every thread when throttled
+            elif resp.status_code in self.THROTTLED_CODES:
+                self.limiter.throttled(retry_after)
             # Exit request loop if non-retry error code
-            elif self.retry_errors:
-                if resp.status_code not in self.retry_errors: break
+            elif retry_errors:
+                if resp.status_code not in retry_errors: break
             else:
                 if resp.status_code in self.OKAY_STATUS: break
+            if retries_performed >= retry_count: break
+            if rewind is not None:
+                replayable = rewind()
+            if not replayable: break
+            if kargs.get('stream'):
+                discard(resp)
+            self.metrics.inc('atmt_http_retries_total',
+                    dict(labels, status=str(resp.status_code)))
 
             # Sleep before retrying request again
-            time.sleep(self.retry_delay)
+            if retry_after is None:
+                retry_after = backoff(retries_performed, retry_delay)
+            with TRACER.span('retry wait', 'http', status=resp.status_code,
+                    seconds=retry_after):
+                time.sleep(retry_after)
             retries_performed += 1
+        if resp.status_code < 400:
+            self.limiter.succeeded()
         return resp
+
+    def record(self, labels, status, start, sent, received):
+        metrics = self.metrics
+        metrics.observe('atmt_http_request_seconds', time.time() - start,
+                labels)
+        metrics.inc('atmt_http_requests_total',
+                dict(labels, status=str(status)))
+        if sent:
+            metrics.inc('atmt_http_sent_bytes_total', labels, sent)
+        if received:
+            metrics.inc('atmt_http_received_bytes_total', labels, received)
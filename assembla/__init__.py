@@ -6,9 +6,11 @@ __author__ = 'Conrado Buhrer'
 __license__ = 'Apache v2'
 
 from assembla.models import Space, User, Ticket, ModelFactory
+from assembla.compact import CompactModelFactory
 from assembla.error import AssemblaError
 from assembla.api import API
 from assembla.cursor import Cursor
+from assembla.asyncapi import AsyncAPI, AsyncCursor
 
 def debug(enable=True, level=1):
 
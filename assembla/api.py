@@ -1,7 +1,11 @@
+import os
+
 from assembla.binder import bind_api
+from assembla.multipart import MultipartEncoder, FileChunks
 from assembla.parsers import ModelParser
 
 from assembla.HttpClient import HttpClient
+from assembla.workers import SingleFlight
 
 
 class API(object):
@@ -10,9 +14,17 @@ class API(object):
     def __init__(self, consumer_key, consumer_secret, pin=None,
             host='api.assembla.com', search_host=None,
             cache=None, secure=False, api_root='/v1/', search_root='',
-            retry_count=0, retry_delay=0, retry_errors=None,
-            parser=None):
-        self.client = HttpClient(consumer_key, consumer_secret, pin)
+            retry_count=3, retry_delay=3, retry_errors=None,
+            parser=None, rate_limit=None, burst=None, pool_connections=4,
+            pool_maxsize=10, pool_block=False, timeout=None, keep_alive=True,
+            coalesce=False, metrics=None):
+        # metrics default to the shared assembla.metrics.REGISTRY
+        self.client = HttpClient(consumer_key, consumer_secret, pin,
+                retry_count=retry_count, retry_delay=retry_delay,
+                retry_errors=retry_errors, rate_limit=rate_limit, burst=burst,
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                pool_block=pool_block, timeout=timeout, keep_alive=keep_alive,
+                metrics=metrics)
         self.host = host
         self.search_host = search_host
         self.api_root = api_root
@@ -24,6 +36,8 @@ class API(object):
         self.retry_errors = retry_errors
         self.okay_status = [200, 201]
         self.parser = parser or ModelParser()
+        # share identical concurrent GETs (and their parsed results)
+        self.coalescer = SingleFlight() if coalesce else None
 
     def getAuthorizeUrl(self):
         return self.client.getAuthorizeUrl()
@@ -60,6 +74,7 @@ class API(object):
         allowed_params = ['space', 'page', 'per_page']
     )
     get_space_tickets.pagination_mode = 'page'
+    get_space_tickets.max_per_page = 100
 
     """ Get possible ticket statuses for a space """
     get_ticket_statuses = bind_api(
@@ -70,15 +85,17 @@ class API(object):
     )
 
     """ Create ticket status in a space """
+    _create_ticket_status = bind_api(
+        path='spaces/{space}/tickets/statuses.json',
+        method='POST',
+        payload_type='ticketstatus',
+        allowed_params = ['space']
+    )
+
     def create_ticket_status(self, status, *args, **kargs):
         post_data=status.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets/statuses.json',
-            method='POST',
-            payload_type='ticketstatus',
-            allowed_params = ['space']
-        )(self, *args, **kargs)
+        return self._create_ticket_status(*args, **kargs)
 
     """ Get possible ticket custom fields"""
     get_custom_fields = bind_api(
@@ -89,15 +106,17 @@ class API(object):
     )
 
     """ Create ticket custom field """
+    _create_custom_field = bind_api(
+        path='spaces/{space}/tickets/custom_fields.json',
+        method='POST',
+        payload_type='ticketcustomfield',
+        allowed_params = ['space']
+    )
+
     def create_custom_field(self, field, *args, **kargs):
         post_data=field.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets/custom_fields.json',
-            method='POST',
-            payload_type='ticketcustomfield',
-            allowed_params = ['space']
-        )(self, *args, **kargs)
+        return self._create_custom_field(*args, **kargs)
 
     """ Get ticket components """
     get_ticket_components = bind_api(
@@ -108,15 +127,17 @@ class API(object):
     )
 
     """ Create ticket component """
+    _create_ticket_component = bind_api(
+        path='spaces/{space}/ticket_components.json',
+        method='POST',
+        payload_type='ticketcomponent',
+        allowed_params = ['space']
+    )
+
     def create_ticket_component(self, component, *args, **kargs):
         post_data=component.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/ticket_components.json',
-            method='POST',
-            payload_type='ticketcomponent',
-            allowed_params = ['space']
-        )(self, *args, **kargs)
+        return self._create_ticket_component(*args, **kargs)
 
     """ Get space milestones """
     get_milestone = bind_api(
@@ -134,17 +155,20 @@ class API(object):
         allowed_params = ['space','page','per_page']
     )
     get_milestones.pagination_mode = 'page'
+    get_milestones.max_per_page = 100
 
     """ Create milestone """
+    _create_milestone = bind_api(
+        path='spaces/{space}/milestones.json',
+        method='POST',
+        payload_type='milestone',
+        allowed_params = ['space']
+    )
+
     def create_milestone(self, milestone, *args, **kargs):
         post_data=milestone.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/milestones.json',
-            method='POST',
-            payload_type='milestone',
-            allowed_params = ['space']
-        )(self, *args, **kargs)
+        return self._create_milestone(*args, **kargs)
 
     """ Get ticket associations """
     get_associations = bind_api(
@@ -155,24 +179,27 @@ class API(object):
     )
 
     """ Create milestone """
+    _create_association = bind_api(
+        path='spaces/{space}/tickets/{ticket}/ticket_associations.json',
+        method='POST',
+        payload_type='ticketassociation',
+        allowed_params = ['space', 'ticket']
+    )
+
     def create_association(self, association, *args, **kargs):
         post_data=association.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets/{ticket}/ticket_associations.json',
-            method='POST',
-            payload_type='ticketassociation',
-            allowed_params = ['space', 'ticket']
-        )(self, *args, **kargs)
+        return self._create_association(*args, **kargs)
 
     """ Get tickets """
     get_tickets = bind_api(
         path='spaces/{space}/tickets.json',
         method='GET',
         payload_type='ticket', payload_list=True,
-        allowed_params = ['space', 'page', 'per_page']
+        allowed_params = ['space', 'page', 'per_page', 'report']
     )
     get_tickets.pagination_mode = 'page'
+    get_tickets.max_per_page = 100
 
     """ Get ticket """
     get_ticket = bind_api(
@@ -191,15 +218,17 @@ class API(object):
     )
 
     """ Create ticket in a space """
+    _create_ticket = bind_api(
+        path='spaces/{space}/tickets.json',
+        method='POST',
+        payload_type='ticket',
+        allowed_params = ['space',]
+    )
+
     def create_ticket(self, ticket, *args, **kargs):
         post_data=ticket.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets.json',
-            method='POST',
-            payload_type='ticket',
-            allowed_params = ['space',]
-        )(self, *args, **kargs)
+        return self._create_ticket(*args, **kargs)
 
     """ Delete ticket """
     delete_ticket = bind_api(
@@ -224,27 +253,32 @@ class API(object):
         allowed_params = ['space', 'ticket', 'page', 'per_page']
     )
     get_ticket_comments.pagination_mode = 'page'
+    get_ticket_comments.max_per_page = 100
 
     """ Create ticket comment """
+    _create_ticket_comment = bind_api(
+        path='spaces/{space}/tickets/{ticket}/ticket_comments.json',
+        method='POST',
+        payload_type='ticketcomment',
+        allowed_params = ['space', 'ticket']
+    )
+
     def create_ticket_comment(self, comment, *args, **kargs):
         post_data=comment.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets/{ticket}/ticket_comments.json',
-            method='POST',
-            payload_type='ticketcomment',
-            allowed_params = ['space', 'ticket']
-        )(self, *args, **kargs)
+        return self._create_ticket_comment(*args, **kargs)
 
     """ Update ticket comment """
+    _update_ticket_comment = bind_api(
+        path='spaces/{space}/tickets/{ticket}/ticket_comments.json',
+        method='POST',
+        payload_type='ticketcomment'
+    )
+
     def update_ticket_comment(self, comment, *args, **kargs):
         post_data = comment.toJSON()
         kargs['post_data'] = post_data
-        return bind_api(
-            path='spaces/{space}/tickets/{ticket}/ticket_comments.json',
-            method='POST',
-            payload_type='ticketcomment'
-        )(self, *args, **kargs)
+        return self._update_ticket_comment(*args, **kargs)
 
     """ Get all document for space """
     get_documents = bind_api(
@@ -254,6 +288,7 @@ class API(object):
         payload_type='document', payload_list=True
     )
     get_documents.pagination_mode = 'page'
+    get_documents.max_per_page = 100
 
     """ Get a document by id """
     get_document = bind_api(
@@ -264,15 +299,20 @@ class API(object):
     )
 
     """ Create document """
+    _create_document = bind_api(
+        path = 'spaces/{space}/documents.json',
+        method = 'POST',
+        payload_type = 'document'
+    )
+
     def create_document(self, filecontent, docmeta, *args, **kargs):
         headers, post_data = API._pack_file(filecontent, docmeta)
         kargs['post_data'] = post_data
         kargs['headers'] = headers
-        return bind_api(
-            path = 'spaces/{space}/documents.json',
-            method = 'POST',
-            payload_type = 'document'
-        )(self, *args, **kargs)
+        try:
+            return self._create_document(*args, **kargs)
+        finally:
+            post_data.close()
 
 
     """ Internal use only """
@@ -281,26 +321,38 @@ class API(object):
 
         fields = ['name', 'attachable_id', 'description', 'attachable_type']
 
-        # build the mulitpart-formdata body
-        BOUNDARY = '4079f119cf48'
-        body = []
-        body.append('--'+BOUNDARY)
-        body.append('Content-Disposition: form-data; name="document[file]"; filename="%s"' % docmeta.name)
-        body.append('Content-Type: application/octet-stream')
-        body.append('')
-        body.append(fileresponse.content)
-        for field in fields:
-            body.append('--'+BOUNDARY)
-            body.append('Content-Disposition: form-data; name="document[%s]"' % field)
-            body.append('')
-            body.append(str(getattr(docmeta, field, '')))
-        body.append('--'+BOUNDARY + '--')
-        body.append('')
-        body = '\r\n'.join(body)
+        # given a function opening the file (or a file on disk) the body
+        # can be read again, so the upload is retried like other requests
+        reopen = None
+        if callable(fileresponse):
+            opener = fileresponse
+            fileresponse = opener()
+            reopen = lambda: FileChunks(opener())
+        elif isinstance(fileresponse, file) and \
+                os.path.exists(fileresponse.name):
+            path = fileresponse.name
+            reopen = lambda: FileChunks(open(path, 'rb'))
+
+        # stream the file into the mulitpart-formdata body
+        chunks = FileChunks(fileresponse)
+        if hasattr(fileresponse, 'iter_content'):
+            size = fileresponse.headers.get('content-length')
+            if size is not None and not fileresponse.headers.get('content-encoding'):
+                size = int(size)
+            else:
+                size = None
+        else:
+            if hasattr(fileresponse, 'fileno'):
+                size = os.fstat(fileresponse.fileno()).st_size
+            else:
+                size = getattr(docmeta, 'filesize', None)
+        body = MultipartEncoder('document[file]', docmeta.name, chunks,
+                [('document[%s]' % field, getattr(docmeta, field, ''))
+                    for field in fields], size, reopen)
 
         # build headers
         headers = {
-            'Content-Type': 'multipart/form-data; boundary=%s' %BOUNDARY,
+            'Content-Type': body.content_type,
         }
 
         return headers, body
@@ -0,0 +1,85 @@
+from assembla.api import API
+from assembla.error import AssemblaError
+from assembla.workers import shared_pool
+
+
+def bind_async(name):
+
+    def _call(self, *args, **kargs):
+        method = getattr(self.api, name)
+        return self.pool.submit(method, *args, **kargs)
+
+    _call.__name__ = name
+    method = getattr(API, name)
+    if hasattr(method, 'pagination_mode'):
+        _call.pagination_mode = method.pagination_mode
+    return _call
+
+
+class AsyncAPI(object):
+    """
+    Non-blocking mirror of API, every endpoint returns a Future.
+
+    Calls run on `pool`, by default the process wide shared_pool(), so
+    its size bounds the requests in flight for every AsyncAPI using it.
+    Calls made from a job already running on the pool run inline.
+    """
+
+    def __init__(self, api, pool=None):
+        self.api = api
+        self.pool = pool or shared_pool()
+
+    def submit(self, func, *args, **kargs):
+        """Run any blocking callable (e.g. a model method) on the pool"""
+        return self.pool.submit(func, *args, **kargs)
+
+    def __getattr__(self, name):
+        # authentication helpers and settings are shared with the sync API
+        return getattr(self.api, name)
+
+
+# Mirror every endpoint of API (bind_api definitions and create_* helpers)
+for _name, _value in API.__dict__.items():
+    if _name.startswith('_') or not callable(_value):
+        continue
+    if _name in ('getAuthorizeUrl', 'initClient', 'initTokens'):
+        continue
+    setattr(AsyncAPI, _name, bind_async(_name))
+
+
+class AsyncCursor(object):
+    """
+    Pagination helper for AsyncAPI methods.
+    The request for the next page is sent before the current page is
+    handed to the caller, so processing overlaps with network time.
+    """
+
+    def __init__(self, method, *args, **kargs):
+        if getattr(method, 'pagination_mode', None) != 'page':
+            raise AssemblaError('This method does not perform page pagination')
+        self.method = method
+        self.args = args
+        self.kargs = kargs
+
+    def pages(self, limit=0):
+        page = 1
+        future = self.method(page=page, *self.args, **self.kargs)
+        while future is not None:
+            items = future.result()
+            if len(items) == 0:
+                return
+            # no request past the last page asked for
+            future = None
+            if not (limit > 0 and page >= limit):
+                page += 1
+                future = self.method(page=page, *self.args, **self.kargs)
+            yield items
+
+    def items(self, limit=0):
+        count = 0
+        for page in self.pages():
+            for item in page:
+                if limit > 0 and count == limit:
+                    return
+                count += 1
+                yield item
@@ -1,12 +1,71 @@
 import urllib
+import time
 import re
 
+from assembla.cache import CacheEntry
+from assembla.HttpClient import discard
 from assembla.error import AssemblaError
+from assembla.metrics import PARSE_BUCKETS
+from assembla.tracing import TRACER
+from assembla.multipart import CHUNK_SIZE
 from assembla.utils import convert_to_utf8_str
 
 re_path_template = re.compile('{\w+}')
 
 
+def compile_path(path):
+    """Turn 'spaces/{space}.json' into ('spaces/%(space)s.json', ['space'])"""
+    variables = [v.strip('{}') for v in re_path_template.findall(path)]
+    template = re_path_template.sub(lambda m: '%%(%s)s' % m.group()[1:-1],
+            path.replace('%', '%%'))
+    return template, variables
+
+
+def compile_parameters(path, allowed_param):
+    """
+    Argument binder of an endpoint, built once when it is bound. It maps
+    a call's (args, kargs) to the request path and the utf-8 encoded
+    query parameters.
+    """
+    template, variables = compile_path(path)
+    positional = tuple(allowed_param)
+    quote = urllib.quote
+
+    def bind(args, kargs):
+        parameters = {}
+        if args:
+            if len(args) > len(positional):
+                raise AssemblaError('Too many parameters supplied!')
+            for name, arg in zip(positional, args):
+                if arg is not None:
+                    parameters[name] = arg
+        for name, arg in kargs.iteritems():
+            if arg is None:
+                continue
+            if name in parameters:
+                raise AssemblaError('Multiple values for parameter %s supplied!' % name)
+            parameters[name] = arg
+        values = {}
+        for name in variables:
+            try:
+                values[name] = quote(convert_to_utf8_str(parameters.pop(name)))
+            except KeyError:
+                raise AssemblaError('No parameter value found for path variable: %s' % name)
+        for name, arg in parameters.iteritems():
+            parameters[name] = convert_to_utf8_str(arg)
+        return template % values, parameters
+
+    return bind
+
+
+def iter_response(resp):
+    try:
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            yield chunk
+    finally:
+        discard(resp)
+
+
 def bind_api(**config):
 
     class APIMethod(object):
@@ -19,6 +78,9 @@ def bind_api(**config):
         require_auth = config.get('require_auth', True)
         search_api = config.get('search_api', False)
         use_cache = config.get('use_cache', True)
+        bind_parameters = staticmethod(compile_parameters(path,
+                allowed_param))
+        span_name = '%s %s' % (method, path)
 
         def __init__(self, api, args, kargs):
             # If authentication is required and no credentials
@@ -33,7 +95,9 @@ def bind_api(**config):
             self.retry_errors = kargs.pop('retry_errors', api.retry_errors)
             self.okay_status = kargs.pop('okay_status', api.okay_status)
             self.headers = kargs.pop('headers', {})
-            self.build_parameters(args, kargs)
+            # yield list items while the response is read
+            self.stream = kargs.pop('stream', False)
+            self.path, self.parameters = self.bind_parameters(args, kargs)
 
             # Assembla accepts multiple formats, we work with json.
             if 'Content-Type' not in self.headers:
@@ -45,9 +109,6 @@ def bind_api(**config):
             else:
                 self.api_root = api.api_root
 
-            # Perform any path variable substitution
-            self.build_path()
-
             if api.secure:
                 self.scheme = 'https://'
             else:
@@ -58,37 +119,6 @@ def bind_api(**config):
             else:
                 self.host = api.host
 
-        def build_parameters(self, args, kargs):
-            self.parameters = {}
-            for idx, arg in enumerate(args):
-                if arg is None:
-                    continue
-
-                try:
-                    self.parameters[self.allowed_param[idx]] = convert_to_utf8_str(arg)
-                except IndexError:
-                    raise AssemblaError('Too many parameters supplied!')
-
-            for k, arg in kargs.items():
-                if arg is None:
-                    continue
-                if k in self.parameters:
-                    raise AssemblaError('Multiple values for parameter %s supplied!' % k)
-
-                self.parameters[k] = convert_to_utf8_str(arg)
-
-        def build_path(self):
-            for variable in re_path_template.findall(self.path):
-                name = variable.strip('{}')
-
-                try:
-                    value = urllib.quote(self.parameters[name])
-                except KeyError:
-                    raise AssemblaError('No parameter value found for path variable: %s' % name)
-                del self.parameters[name]
-
-                self.path = self.path.replace(variable, value)
-
         def execute(self):
             # Build the request URL
             schema = 'https://' if self.api.secure else 'http://'
@@ -96,13 +126,86 @@ def bind_api(**config):
             if len(self.parameters):
                 url = '%s?%s' % (url, urllib.urlencode(self.parameters))
 
+            start = time.time()
+            # set by send, which followers of a coalesced call never run
+            self.status = 'error'
+            with TRACER.span(self.span_name, 'api', path=self.path) as span:
+                try:
+                    # Identical GETs in flight share one request, each
+                    # caller parses the response into models of its own
+                    # since callers change them (e.g. remapped comments)
+                    coalescer = getattr(self.api, 'coalescer', None)
+                    if coalescer and self.method == 'GET' and not self.stream:
+                        key = (self.method, self.path,
+                                tuple(sorted(self.parameters.items())))
+                        self.status = 'coalesced'
+                        content = coalescer.do(key, self.send, url, True)
+                        if content is None:
+                            return []
+                        return self.parse(content)
+                    return self.send(url)
+                finally:
+                    span.set('status', self.status)
+                    labels = {'method': self.method,
+                            'endpoint': APIMethod.path}
+                    metrics = self.api.client.metrics
+                    metrics.observe('atmt_api_call_seconds',
+                            time.time() - start, labels)
+                    metrics.inc('atmt_api_calls_total',
+                            dict(labels, status=str(self.status)))
+
+        def parse(self, content):
+            start = time.time()
+            try:
+                return self.api.parser.parse(self, content)
+            finally:
+                self.api.client.metrics.observe('atmt_api_parse_seconds',
+                        time.time() - start, {'method': self.method,
+                        'endpoint': APIMethod.path}, PARSE_BUCKETS)
+
+        def send(self, url, raw=False):
+            # With raw the response content is returned unparsed (None
+            # when there is none)
+            parse = (lambda content: content) if raw else self.parse
+            # Query the cache if one is available
+            # and this request uses a GET method.
+            cache = self.api.cache if self.use_cache else None
+            entry = None
+            if cache and self.method == 'GET':
+                entry = cache.get(url)
+                if entry is not None:
+                    if not entry.expired(cache.timeout_for(APIMethod.path)):
+                        self.status = 'cached'
+                        return parse(entry.content)
+                    if not entry.revalidatable():
+                        entry = None
+                    else:
+                        self.headers = dict(self.headers)
+                        if entry.etag:
+                            self.headers['If-None-Match'] = entry.etag
+                        if entry.last_modified:
+                            self.headers['If-Modified-Since'] = entry.last_modified
+
+            # cached responses are stored whole, so they are not streamed
+            stream = self.stream and self.payload_list and \
+                    self.method == 'GET' and not cache and \
+                    hasattr(self.api.parser, 'parse_stream')
+
             m = getattr(self.api.client, self.method)
-            resp = m(url, headers=self.headers, data=self.post_data)
+            resp = m(url, headers=self.headers, data=self.post_data,
+                    stream=stream, endpoint=APIMethod.path,
+                    retry_count=self.retry_count, retry_delay=self.retry_delay,
+                    retry_errors=self.retry_errors)
 
             # If an error was returned, throw an exception
             self.api.last_response = resp
-            if resp.status_code == 204:
-                return []
+            self.status = resp.status_code
+            if resp.status_code == 304 and entry is not None:
+                cache.touch(url)
+                return parse(entry.content)
+            elif resp.status_code == 204:
+                self.invalidate_cache(cache, url)
+                return None if raw else []
             elif resp.status_code not in self.okay_status:
                 try:
                     error_msg = self.api.parser.parse_error(resp.content)
@@ -110,10 +213,34 @@ def bind_api(**config):
                     error_msg = "Assembla error response: status code = %s" % resp.status_code
                 raise AssemblaError(error_msg, resp)
 
+            if stream:
+                return self.api.parser.parse_stream(self, iter_response(resp))
+
+            # Store result into cache if one is available.
+            if cache and self.method == 'GET':
+                cache.store(url, CacheEntry(resp.content,
+                        resp.headers.get('etag'),
+                        resp.headers.get('last-modified')))
+            else:
+                self.invalidate_cache(cache, url)
+
             # Parse the response payload
-            result = self.api.parser.parse(self, resp.content)
+            result = parse(resp.content)
             return result
 
+        def invalidate_cache(self, cache, url):
+            # Writes drop the resource, anything below it and its parent,
+            # e.g. POST .../tickets/5/ticket_comments.json invalidates the
+            # comment listings and .../tickets/5.json
+            if not cache or self.method == 'GET':
+                return
+            resource = url.split('?', 1)[0]
+            if resource.endswith('.json'):
+                resource = resource[:-len('.json')]
+            cache.invalidate(resource + '.json')
+            cache.invalidate(resource + '/')
+            cache.invalidate(resource.rsplit('/', 1)[0] + '.json')
+
 
     def _call(api, *args, **kargs):
 
@@ -0,0 +1,135 @@
+import os
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+
+from assembla.multipart import CHUNK_SIZE
+
+
+class BlobStore(object):
+    """
+    Local content addressed store for downloaded documents.
+
+    Blobs are files named by the SHA-1 of their content, a SQLite index
+    maps Assembla document versions (see key) to them so documents
+    referenced again (or downloaded by an earlier run) are read locally.
+    Least recently used blobs are evicted once their total size exceeds
+    max_size.
+    """
+
+    def __init__(self, directory, max_size=2*1024*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(os.path.join(directory, 'index.db'),
+                check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                'digest TEXT PRIMARY KEY, size INTEGER, used_at REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS documents ('
+                'document TEXT PRIMARY KEY, digest TEXT)')
+        self.db.commit()
+        self.size = self.db.execute('SELECT SUM(size) FROM blobs'
+                ).fetchone()[0] or 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(document):
+        """Index key of a document, new versions get a key of their own"""
+        version = getattr(document, 'version', None) or \
+                getattr(document, 'updated_at', None)
+        if version is None:
+            return str(document.id)
+        return '%s@%s' % (document.id, version)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def lookup(self, document_id):
+        """Path of the blob stored for a document, None if not stored"""
+        with self.lock:
+            return self._lookup(document_id)
+
+    def _lookup(self, document_id):
+        row = self.db.execute('SELECT digest FROM documents WHERE '
+                'document = ?', (str(document_id),)).fetchone()
+        if row is None or not os.path.exists(self.path(row[0])):
+            return None
+        self.db.execute('UPDATE blobs SET used_at = ? WHERE digest = ?',
+                (time.time(), row[0]))
+        self.db.commit()
+        return self.path(row[0])
+
+    def store(self, document_id, chunks, opened=False):
+        """
+        Write chunks to the store while hashing them, return the path. With
+        `opened` the blob is returned open for reading instead, opened
+        before another store can evict it.
+        """
+        digest = hashlib.sha1()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            with self.lock:
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(tmp, path)
+                if not self.db.execute('SELECT 1 FROM blobs WHERE digest = ?',
+                        (digest,)).fetchone():
+                    self.size += size
+                self.db.execute('INSERT OR REPLACE INTO blobs VALUES '
+                        '(?, ?, ?)', (digest, size, time.time()))
+                self.db.execute('INSERT OR REPLACE INTO documents VALUES '
+                        '(?, ?)', (str(document_id), digest))
+                self._evict(digest)
+                self.db.commit()
+                if opened:
+                    return open(path, 'rb')
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+
+    def _evict(self, keep):
+        while self.size > self.max_size:
+            row = self.db.execute('SELECT digest, size FROM blobs WHERE '
+                    'digest != ? ORDER BY used_at LIMIT 1', (keep,)).fetchone()
+            if row is None:
+                break
+            digest, size = row
+            self.db.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            self.db.execute('DELETE FROM documents WHERE digest = ?', (digest,))
+            if os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
+            self.size -= size
+
+    def open(self, document, session):
+        """Open a document, downloading it through session if not stored"""
+        # blobs are opened with the lock held, an open blob stays readable
+        # when evicted by a later store
+        key = self.key(document)
+        with self.lock:
+            path = self._lookup(key)
+            if path is not None:
+                try:
+                    f = open(path, 'rb')
+                except IOError:
+                    pass # removed meanwhile
+                else:
+                    self.hits += 1
+                    return f
+            self.misses += 1
+        response = session.get(document.url, stream=True)
+        return self.store(key, response.iter_content(CHUNK_SIZE),
+                opened=True)
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class CacheEntry(object):
+    """Raw GET response kept by a cache, along with its validators"""
+
+    def __init__(self, content, etag=None, last_modified=None, stored_at=None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at or time.time()
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def expired(self, timeout):
+        return timeout is not None and time.time() - self.stored_at >= timeout
+
+    def revalidatable(self):
+        return bool(self.etag or self.last_modified)
+
+
+class Cache(object):
+    """
+    Cache interface.
+
+    Entries younger than their timeout are served without a request, older
+    entries are kept (until evicted) to revalidate with the server.
+    `timeouts` maps endpoint path templates to their own timeout, e.g.
+    {'spaces/{space}/tickets/statuses.json': 3600}.
+    """
+
+    def __init__(self, timeout=60, timeouts=None, max_size=64*1024*1024):
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.max_size = max_size
+        self.lock = threading.RLock()
+
+    def timeout_for(self, template):
+        return self.timeouts.get(template, self.timeout)
+
+    def get(self, key):
+        """Get the cached entry for key, None if not cached"""
+        raise NotImplementedError
+
+    def store(self, key, entry):
+        """Add new entry to the cache, evicting old ones if needed"""
+        raise NotImplementedError
+
+    def touch(self, key):
+        """Mark entry as freshly validated"""
+        raise NotImplementedError
+
+    def invalidate(self, prefix):
+        """Drop every entry whose key starts with prefix"""
+        raise NotImplementedError
+
+    def count(self):
+        """Get count of entries currently stored in cache"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Delete all cached entries"""
+        raise NotImplementedError
+
+
+class MemoryCache(Cache):
+    """In-memory LRU cache, bounded by the total size of stored content"""
+
+    def __init__(self, timeout=60, timeouts=None, max_size=64*1024*1024):
+        Cache.__init__(self, timeout, timeouts, max_size)
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def store(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            if entry.size > self.max_size:
+                return
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                k, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def touch(self, key):
+        with self.lock:
+            entry = self.get(key)
+            if entry is not None:
+                entry.stored_at = time.time()
+
+    def invalidate(self, prefix):
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                self.size -= self.entries.pop(key).size
+
+    def count(self):
+        return len(self.entries)
+
+    def flush(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class DiskCache(Cache):
+    """
+    Persistent cache kept in a SQLite database file, evicts least
+    recently used entries once stored content exceeds max_size.
+    """
+
+    def __init__(self, filename, timeout=60, timeouts=None,
+            max_size=512*1024*1024):
+        Cache.__init__(self, timeout, timeouts, max_size)
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, content BLOB, etag TEXT, '
+                'last_modified TEXT, stored_at REAL, used_at REAL, '
+                'size INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_used_at '
+                'ON entries (used_at)')
+        self.db.commit()
+        self.size = self._sum('')
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT content, etag, last_modified, '
+                    'stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE entries SET used_at = ? WHERE key = ?',
+                    (time.time(), key))
+            self.db.commit()
+            return CacheEntry(str(row[0]), row[1], row[2], row[3])
+
+    def _sum(self, prefix):
+        return self.db.execute('SELECT SUM(size) FROM entries WHERE '
+                'substr(key, 1, ?) = ?', (len(prefix), prefix)).fetchone()[0] or 0
+
+    def store(self, key, entry):
+        if entry.size > self.max_size:
+            return
+        with self.lock:
+            old = self.db.execute('SELECT size FROM entries WHERE key = ?',
+                    (key,)).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.size += entry.size
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?)', (key,
+                    sqlite3.Binary(entry.content), entry.etag,
+                    entry.last_modified, entry.stored_at, time.time(),
+                    entry.size))
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            rows = self.db.execute('SELECT key, size FROM entries '
+                    'ORDER BY used_at LIMIT 64').fetchall()
+            for key, size in rows:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def touch(self, key):
+        with self.lock:
+            now = time.time()
+            self.db.execute('UPDATE entries SET stored_at = ?, used_at = ? '
+                    'WHERE key = ?', (now, now, key))
+            self.db.commit()
+
+    def invalidate(self, prefix):
+        with self.lock:
+            self.size -= self._sum(prefix)
+            self.db.execute('DELETE FROM entries WHERE substr(key, 1, ?) = ?',
+                    (len(prefix), prefix))
+            self.db.commit()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def flush(self):
+        with self.lock:
+            self.db.execute('DELETE FROM entries')
+            self.db.commit()
+            self.size = 0
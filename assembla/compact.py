@@ -0,0 +1,151 @@
+"""
+Compact models: __slots__ based copies of the classes in assembla.models
+declared from per model field schemas. Fields missing from a schema are
+kept in a small overflow dict, attribute access and toJSON output stay
+the same. Opt in with ModelParser(model_factory=CompactModelFactory),
+the migration tool does not use them. They are not Model subclasses and
+are always parsed eagerly, ModelParser refuses lazy=True with them.
+"""
+from assembla import models
+from assembla.models import Model, ModelFactory
+
+
+class CompactModel(object):
+
+    __slots__ = ('_api', '_extra')
+
+    def __init__(self, api=None):
+        object.__setattr__(self, '_api', api)
+        object.__setattr__(self, '_extra', None)
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+
+    def __getattr__(self, name):
+        # only called for unset slots and fields outside the schema
+        extra = object.__getattribute__(self, '_extra')
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def __delattr__(self, name):
+        if name in self.FIELDS:
+            object.__delattr__(self, name)
+        elif self._extra and name in self._extra:
+            del self._extra[name]
+        else:
+            raise AttributeError(name)
+
+    def __getstate__(self):
+        # pickle, same as Model.__getstate__ (without the API reference)
+        pickle = {}
+        for name in self.__slots__:
+            try:
+                pickle[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        if self._extra:
+            pickle.update(self._extra)
+        return pickle
+
+    def __setstate__(self, state):
+        CompactModel.__init__(self)
+        for k, v in state.items():
+            setattr(self, k, v)
+
+for _name in ('toJSON', 'parse', 'parse_list', '__str__', '__repr__'):
+    setattr(CompactModel, _name, Model.__dict__[_name])
+
+
+def compact(model, fields):
+    """Build the __slots__ based copy of a model class"""
+    attrs = {}
+    for k, v in model.__dict__.items():
+        if k not in ('__dict__', '__weakref__', '__init__'):
+            attrs[k] = v
+    fields = tuple(fields)
+    attrs['__slots__'] = fields
+    attrs['FIELDS'] = frozenset(fields)
+    attrs['__module__'] = __name__
+    return type(model.__name__, (CompactModel,), attrs)
+
+
+TIMESTAMPS = ('created_at', 'updated_at')
+
+Space = compact(models.Space, TIMESTAMPS + (
+    'id', 'name', 'description', 'wiki_name', 'public_permissions',
+    'team_permissions', 'watcher_permissions', 'share_permissions',
+    'team_tab_role', 'default_showpage', 'tabs_order', 'parent_id',
+    'restricted', 'restricted_date', 'commercial_from', 'banner',
+    'banner_height', 'banner_text', 'banner_link', 'style', 'status',
+    'approved', 'is_manager', 'is_volunteer', 'is_commercial',
+    'can_join', 'can_apply', 'last_payer_changed_at'))
+
+User = compact(models.User, (
+    'id', 'login', 'login_name', 'name', 'picture', 'email',
+    'organization', 'phone', 'im', 'im2'))
+
+Ticket = compact(models.Ticket, TIMESTAMPS + (
+    'id', 'number', 'summary', 'description', 'priority', 'completed_date',
+    'component_id', 'created_on', 'permission_type', 'importance',
+    'is_story', 'milestone_id', 'notification_list', 'space_id', 'state',
+    'status', 'story_importance', 'working_hours', 'estimate',
+    'total_estimate', 'total_invested_hours', 'total_working_hours',
+    'assigned_to_id', 'reporter_id', 'custom_fields', 'hierarchy_type',
+    'due_date'))
+
+TicketComment = compact(models.TicketComment, TIMESTAMPS + (
+    'id', 'comment', 'user_id', 'created_on', 'ticket_id',
+    'ticket_changes', 'rendered', 'file'))
+
+TicketCustomField = compact(models.TicketCustomField, TIMESTAMPS + (
+    'id', 'space_tool_id', 'title', 'type', 'order', 'required',
+    'hide', 'default_value', 'list_options', 'created_on'))
+
+TicketComponent = compact(models.TicketComponent, ('id', 'name'))
+
+TicketAssociation = compact(models.TicketAssociation, TIMESTAMPS + (
+    'id', 'ticket1_id', 'ticket2_id', 'relationship'))
+
+TicketStatus = compact(models.TicketStatus, TIMESTAMPS + (
+    'id', 'space_tool_id', 'name', 'state', 'list_order'))
+
+Milestone = compact(models.Milestone, TIMESTAMPS + (
+    'id', 'title', 'description', 'start_date', 'due_date', 'budget',
+    'user_id', 'created_by', 'updated_by', 'space_id', 'is_completed',
+    'completed_date', 'release_level', 'release_notes', 'planner_type',
+    'pretty_release_level'))
+
+Document = compact(models.Document, TIMESTAMPS + (
+    'id', 'name', 'filename', 'content_type', 'created_by', 'updated_by',
+    'version', 'filesize', 'description', 'cached_tag', 'position', 'url',
+    'ticket_id', 'attachable_type', 'attachable_id', 'attachable_guid',
+    'has_thumbnail', 'space_id'))
+
+MergeRequest = compact(models.MergeRequest, TIMESTAMPS + (
+    'id', 'space_tool_id', 'source_symbol', 'source_symbol_type',
+    'target_space_tool_id', 'target_symbol', 'target_symbol_type',
+    'title', 'description', 'status', 'user_id', 'applied_at'))
+
+
+class CompactModelFactory(ModelFactory):
+    """ModelFactory creating the compact models"""
+
+    space = Space
+    user = User
+
+    ticket = Ticket
+    ticketcomment = TicketComment
+    ticketcustomfield = TicketCustomField
+    ticketcomponent = TicketComponent
+    ticketassociation = TicketAssociation
+    ticketstatus = TicketStatus
+
+    document = Document
+    milestone = Milestone
+    mergerequest = MergeRequest
@@ -1,4 +1,10 @@
+import sys
+import Queue
+import threading
+from collections import deque
+
 from assembla.error import AssemblaError
+from assembla.workers import WorkerPool
 
 class Cursor(object):
     """Pagination helper class"""
@@ -12,16 +18,37 @@ class Cursor(object):
         else:
             raise AssemblaError('This method does not perform pagination')
 
-    def pages(self, limit=0):
-        """Return iterator for pages"""
+    def pages(self, limit=0, prefetch=0, parallel=0, total=None):
+        """
+        Return iterator for pages, with prefetch the next pages (up to
+        prefetch of them) are fetched in background while one is processed.
+        With parallel that many pages are requested at once, `total` (the
+        known or estimated number of items) avoids requesting past the end.
+        """
         if limit > 0:
             self.iterator.limit = limit
-        return self.iterator
+        iterator = self.iterator
+        if parallel > 1:
+            if not hasattr(iterator, 'fetch'):
+                raise AssemblaError('This method does not support parallel pagination')
+            iterator = ParallelPageIterator(iterator, parallel, total)
+        if prefetch > 0:
+            iterator = PrefetchIterator(iterator, prefetch)
+        return iterator
 
-    def items(self, limit=0):
-        """Return iterator for items in each page"""
-        i = ItemIterator(self.iterator)
+    def items(self, limit=0, stream=False, prefetch=0, parallel=0, total=None):
+        """
+        Return iterator for items in each page, with stream items are
+        parsed while each page is read instead of a whole page at once
+        """
+        if stream and not hasattr(self.iterator, 'next_stream'):
+            raise AssemblaError('This method does not support streaming')
+        if stream and (prefetch > 0 or parallel > 1):
+            raise AssemblaError('Streamed pages can not be prefetched')
+        i = ItemIterator(self.pages(prefetch=prefetch, parallel=parallel,
+                total=total))
         i.limit = limit
+        i.stream = stream
         return i
 
 class BaseIterator(object):
@@ -71,23 +98,217 @@ class CursorIterator(BaseIterator):
         return data
 
 class PageIterator(BaseIterator):
+    """
+    Pages requested with the largest page size of the method (its
+    max_per_page) unless one is given. Once that size is known to be
+    honoured (per_page_honoured of the method, the largest size declared
+    or seen served whole) a shorter page is the last one and no request
+    is made for the empty page after it. Until then only an empty page
+    ends the listing, so a server capping pages lower loses nothing.
+    """
 
     def __init__(self, method, args, kargs):
         BaseIterator.__init__(self, method, args, kargs)
         self.current_page = 0
+        self.exhausted = False
+        self.per_page = None
+        max_per_page = getattr(method, 'max_per_page', None)
+        if max_per_page:
+            self.kargs = dict(kargs)
+            if self.kargs.get('per_page') is None:
+                self.kargs['per_page'] = max_per_page
+            # larger pages may be truncated by the server, a short page
+            # only marks the end when the page size is honoured
+            if int(self.kargs['per_page']) <= max_per_page:
+                self.per_page = int(self.kargs['per_page'])
+
+    def fetch(self, page):
+        return self.method(page=page, *self.args, **self.kargs)
+
+    def last_page(self, count):
+        if not self.per_page:
+            return count == 0
+        method = getattr(self.method, 'im_func', self.method)
+        honoured = getattr(method, 'per_page_honoured', 0)
+        if count >= self.per_page:
+            # a full page, pages this large are served whole from now on
+            if self.per_page > honoured:
+                method.per_page_honoured = self.per_page
+            return False
+        return count == 0 or self.per_page <= honoured
 
     def next(self):
+        if self.exhausted or (self.limit > 0 and self.current_page >= self.limit):
+            raise StopIteration
         self.current_page += 1
-        items = self.method(page=self.current_page, *self.args, **self.kargs)
-        if len(items) == 0 or (self.limit > 0 and self.current_page > self.limit):
+        items = self.fetch(self.current_page)
+        self.exhausted = self.last_page(len(items))
+        if len(items) == 0:
             raise StopIteration
         return items
 
+    def next_stream(self):
+        """Return an iterator over the items of the next page"""
+        if self.exhausted or (self.limit > 0 and self.current_page >= self.limit):
+            raise StopIteration
+        self.current_page += 1
+        return iter(self.method(page=self.current_page, stream=True,
+                *self.args, **self.kargs))
+
     def prev(self):
         if (self.current_page == 1):
             raise AssemblaError('Can not page back more, at first page')
         self.current_page -= 1
-        return self.method(page=self.current_page, *self.args, **self.kargs)
+        self.exhausted = False
+        return self.fetch(self.current_page)
+
+
+class ParallelPageIterator(BaseIterator):
+    """
+    Pages of a PageIterator requested `workers` at a time, handed out in
+    order. Without `total` pages are requested speculatively until the
+    last page, past the estimated number of pages they are requested one
+    by one.
+    """
+
+    def __init__(self, page_iterator, workers, total=None):
+        self.page_iterator = page_iterator
+        self.limit = 0
+        self.window = workers
+        self.pool = WorkerPool(workers, 'ATMT-pages')
+        self.pending = deque()
+        self.next_page = page_iterator.current_page + 1
+        self.last = None
+        if total is not None and page_iterator.per_page:
+            self.last = max(1, -(-total // page_iterator.per_page))
+
+    def schedule(self):
+        pages = self.page_iterator
+        while len(self.pending) < self.window and not pages.exhausted:
+            page = self.next_page
+            if pages.limit > 0 and page > pages.limit:
+                break
+            if self.last is not None and page > self.last and self.pending:
+                break
+            self.pending.append((page, self.pool.submit(pages.fetch, page)))
+            self.next_page += 1
+
+    def next(self):
+        self.schedule()
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        page, future = self.pending.popleft()
+        try:
+            items = future.result()
+        except Exception:
+            self.close()
+            raise
+        pages = self.page_iterator
+        pages.current_page = page
+        if pages.last_page(len(items)):
+            pages.exhausted = True
+            # requests sent past the end are dropped
+            self.pending.clear()
+        if len(items) == 0:
+            self.close()
+            raise StopIteration
+        return items
+
+    def prev(self):
+        raise AssemblaError('Can not page back on parallel pages')
+
+    def close(self):
+        self.pending.clear()
+        self.pool.shutdown(wait=False)
+
+    def __del__(self):
+        self.close()
+
+class Prefetcher(object):
+    """Background worker of a PrefetchIterator"""
+
+    def __init__(self, page_iterator, depth):
+        self.page_iterator = page_iterator
+        self.pages = Queue.Queue()
+        # one slot per page fetched ahead and not yet consumed
+        self.slots = threading.Semaphore(depth)
+        self.cancelled = threading.Event()
+
+    def run(self):
+        while True:
+            self.slots.acquire()
+            if self.cancelled.is_set():
+                return
+            try:
+                page = self.page_iterator.next()
+            except StopIteration:
+                self.pages.put((None, None))
+                return
+            except Exception:
+                self.pages.put((None, sys.exc_info()))
+                return
+            self.pages.put((page, None))
+
+    def cancel(self):
+        self.cancelled.set()
+        self.slots.release()
+
+
+class PrefetchIterator(BaseIterator):
+    """
+    Pages of a page iterator fetched ahead by a background thread, at most
+    `depth` pages are buffered. The first page is fetched inline and the
+    thread only started when more pages follow it, so listings of a
+    single page (most ticket comments) cost no thread. Iteration stopping
+    early (close() or the iterator being dropped) cancels the fetching.
+    """
+
+    def __init__(self, page_iterator, depth):
+        self.page_iterator = page_iterator
+        self.prefetcher = Prefetcher(page_iterator, depth)
+        self.limit = 0
+        self.thread = None
+        self.finished = False
+
+    def next(self):
+        if self.finished:
+            raise StopIteration
+        if self.thread is None:
+            try:
+                page = self.page_iterator.next()
+            except:
+                self.finished = True
+                raise
+            if getattr(self.page_iterator, 'exhausted', False):
+                self.finished = True
+            else:
+                self.thread = threading.Thread(target=self.prefetcher.run,
+                        name='ATMT-prefetch')
+                self.thread.daemon = True
+                self.thread.start()
+            return page
+        page, exc_info = self.prefetcher.pages.get()
+        self.prefetcher.slots.release()
+        if exc_info is not None:
+            self.finished = True
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if page is None:
+            self.finished = True
+            raise StopIteration
+        return page
+
+    def prev(self):
+        raise AssemblaError('Can not page back on prefetched pages')
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.prefetcher.cancel()
+
+    def __del__(self):
+        self.close()
+
 
 class ItemIterator(BaseIterator):
 
@@ -97,10 +318,15 @@ class ItemIterator(BaseIterator):
         self.current_page = None
         self.page_index = -1
         self.count = 0
+        self.stream = False
 
     def next(self):
         if self.limit > 0 and self.count == self.limit:
+            if hasattr(self.page_iterator, 'close'):
+                self.page_iterator.close()
             raise StopIteration
+        if self.stream:
+            return self.next_streamed()
         if self.current_page is None or self.page_index == len(self.current_page) - 1:
             # Reached end of current page, get the next page...
             self.current_page = self.page_iterator.next()
@@ -109,7 +335,28 @@ class ItemIterator(BaseIterator):
         self.count += 1
         return self.current_page[self.page_index]
 
+    def next_streamed(self):
+        while True:
+            if self.current_page is None:
+                self.current_page = self.page_iterator.next_stream()
+                self.page_index = -1
+            try:
+                item = self.current_page.next()
+            except StopIteration:
+                if self.page_index == -1:
+                    # empty page, no more items
+                    raise
+                if self.page_iterator.last_page(self.page_index + 1):
+                    self.page_iterator.exhausted = True
+                self.current_page = None
+                continue
+            self.page_index += 1
+            self.count += 1
+            return item
+
     def prev(self):
+        if self.stream:
+            raise AssemblaError('Can not go back on streamed items')
         if self.current_page is None:
             raise AssemblaError('Can not go back more, at first page')
         if self.page_index == 0:
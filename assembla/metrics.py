@@ -0,0 +1,203 @@
+"""
+Counters and latency histograms of the API calls, labelled by endpoint
+template and status. Exported as Prometheus text (file or HTTP endpoint)
+and as a JSON summary.
+"""
+import os
+import json
+import tempfile
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+        10.0, 30.0)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile. Values past the
+        last bucket are reported as its bound (JSON has no Infinity).
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return self.buckets[-1] if self.count else 0.0
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+
+class Metrics(object):
+    """Thread safe registry, one is shared by default (REGISTRY)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels, buckets=LATENCY_BUCKETS):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # Prometheus
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('\\',
+                '\\\\').replace('"', '\\"')) for k, v in labels])
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, self.format_labels(labels), value))
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (name, self.format_labels(
+                        labels, [('le', repr(bound))]), cumulative))
+            lines.append('%s_bucket%s %s' % (name, self.format_labels(
+                    labels, [('le', '+Inf')]), histogram.count))
+            lines.append('%s_sum%s %r' % (name, self.format_labels(labels),
+                    histogram.sum))
+            lines.append('%s_count%s %s' % (name, self.format_labels(labels),
+                    histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        """Write the text format atomically (node exporter textfile style)"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus())
+        os.rename(tmp, filename)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the text format on http://host:port/metrics"""
+        import BaseHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        t = threading.Thread(target=server.serve_forever,
+                name='ATMT-metrics')
+        t.daemon = True
+        t.start()
+        return server
+
+    # JSON
+
+    def summary(self):
+        """Per endpoint totals, e.g. summary()['GET spaces/{space}.json']"""
+        endpoints = {}
+
+        def entry(labels):
+            labels = dict(labels)
+            name = '%s %s' % (labels.get('method', ''),
+                    labels.get('endpoint', ''))
+            return endpoints.setdefault(name, {'calls': 0, 'statuses': {},
+                    'requests': 0, 'retries': 0, 'sent_bytes': 0,
+                    'received_bytes': 0}), labels
+
+        with self.lock:
+            counters = self.counters.items()
+            histograms = [(key, h) for key, h in self.histograms.items()]
+        for (name, labels), value in counters:
+            e, labels = entry(labels)
+            if name == 'atmt_api_calls_total':
+                e['calls'] += value
+                status = labels.get('status')
+                e['statuses'][status] = e['statuses'].get(status, 0) + value
+            elif name == 'atmt_http_requests_total':
+                e['requests'] += value
+            elif name == 'atmt_http_retries_total':
+                e['retries'] += value
+            elif name == 'atmt_http_sent_bytes_total':
+                e['sent_bytes'] += value
+            elif name == 'atmt_http_received_bytes_total':
+                e['received_bytes'] += value
+        merged = {}
+        for (name, labels), histogram in histograms:
+            e, labels = entry(labels)
+            key = (name, id(e))
+            if key not in merged:
+                merged[key] = (e, Histogram(histogram.buckets))
+            merged[key][1].merge(histogram)
+        for (name, _), (e, histogram) in merged.items():
+            prefix = {'atmt_api_call_seconds': 'call',
+                    'atmt_http_request_seconds': 'request',
+                    'atmt_api_parse_seconds': 'parse'}.get(name)
+            if prefix:
+                e['%s_seconds' % prefix] = round(histogram.sum, 6)
+                e['%s_p50' % prefix] = histogram.quantile(0.5)
+                e['%s_p99' % prefix] = histogram.quantile(0.99)
+        return endpoints
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+
+REGISTRY = Metrics()
@@ -1,3 +1,6 @@
+import copy
+import copy_reg
+
 from assembla.utils import parse_datetime, parse_date, parse_file
 from assembla.cursor import Cursor
 
@@ -5,17 +8,31 @@ from utils import import_simplejson, DateTimeJSONEncoder
 
 json = import_simplejson()
 
+_lazy_models = {}
+
+def _reduce_lazy(model):
+    # pickle lazy models as the (hydrated) model they were made from
+    return copy_reg.__newobj__, (model.__class__.__bases__[0],), \
+            model.__getstate__()
+
+
 class ResultSet(list):
     """A list like object that holds results from a Twitter API query."""
 
 
 class Model(object):
 
+    # field conversions, also used to hydrate lazy models
+    converters = {}
+    # fields a lazy model computes on access when missing from the json
+    derived = ()
+
     def __init__(self, api=None):
         self._api = api
 
     def __getstate__(self):
         # pickle
+        self.hydrate()
         pickle = dict(self.__dict__)
         try:
             del pickle['_api']  # do not pickle the API reference
@@ -23,6 +40,55 @@ class Model(object):
             pass
         return pickle
 
+    def __getattr__(self, name):
+        # only called for missing attributes: convert lazy fields on access
+        raw = self.__dict__.get('_raw')
+        if raw is None or name.startswith('__'):
+            raise AttributeError(name)
+        value = self._hydrate(name, raw)
+        self.__dict__[name] = value
+        return value
+
+    def _hydrate(self, name, raw):
+        if name not in raw:
+            raise AttributeError(name)
+        value = raw[name]
+        converter = self.converters.get(name)
+        if converter and value:
+            value = converter(value)
+        return value
+
+    def hydrate(self):
+        """Convert every field of a lazy model"""
+        raw = self.__dict__.pop('_raw', None)
+        if raw is None:
+            return
+        for name in list(raw) + list(self.derived):
+            if name not in self.__dict__:
+                try:
+                    self.__dict__[name] = self._hydrate(name, raw)
+                except AttributeError:
+                    pass
+
+    @classmethod
+    def lazy(cls):
+        """Subclass whose parse only wraps the json, see parse_lazy"""
+        try:
+            return _lazy_models[cls]
+        except KeyError:
+            model = _lazy_models[cls] = type(cls.__name__, (cls,), {
+                'parse': Model.__dict__['parse_lazy'],
+                '__reduce__': _reduce_lazy})
+            return model
+
+    @classmethod
+    def parse_lazy(cls, api, json):
+        """Wrap a JSON object, fields are converted on first access"""
+        model = cls.__new__(cls)
+        model._api = api
+        model._raw = json
+        return model
+
     def toJSON(self):
         return json.dumps(self)
 
@@ -50,6 +116,14 @@ class Model(object):
 
 class Space(Model):
 
+    converters = {
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+        'commercial_from': parse_datetime,
+        'restricted_date': parse_date,
+        'last_payer_changed_at': parse_date,
+    }
+
     @classmethod
     def parse(cls, api, json):
         space = cls(api)
@@ -83,8 +157,13 @@ class Space(Model):
     def get_milestone(self, milestone_id):
         return self._api.get_milestone(space=self.id, milestone=milestone_id)
 
-    def get_milestones(self):
-        return list(Cursor(self._api.get_milestones, space=self.id).items())
+    def get_milestones(self, prefetch=2):
+        return list(self.iter_milestones(prefetch=prefetch))
+
+    def iter_milestones(self, per_page=None, prefetch=1, **filters):
+        """Yield milestones while pages of per_page are listed"""
+        return Cursor(self._api.get_milestones, space=self.id,
+                per_page=per_page, **filters).items(prefetch=prefetch)
 
     def create_milestone(self, milestone):
         return self._api.create_milestone(milestone, space=self.id)
@@ -107,12 +186,33 @@ class Space(Model):
     def create_ticket_status(self, status):
         return self._api.create_ticket_status(status, space=self.id)
 
-    def get_tickets(self):
-        return list(Cursor(self._api.get_tickets, space=self.id).items())
+    def get_tickets(self, per_page=None, report=None, prefetch=2):
+        return list(self.iter_tickets(per_page, report, prefetch))
+
+    def iter_tickets(self, per_page=None, report=None, prefetch=1, **filters):
+        """
+        Yield tickets while pages of per_page are listed, filters (e.g.
+        sort_by, sort_order) are sent with the listing
+        """
+        return Cursor(self._api.get_tickets, space=self.id,
+                per_page=per_page, report=report, **filters).items(
+                prefetch=prefetch)
+
+    def iter_documents(self, per_page=None, prefetch=1, **filters):
+        """Yield documents while pages of per_page are listed"""
+        return Cursor(self._api.get_documents, space=self.id,
+                per_page=per_page, **filters).items(prefetch=prefetch)
 
     def get_ticket(self, number):
         return self._api.get_ticket(space=self.id, ticket=number)
 
+    def get_associations(self, number):
+        return self._api.get_associations(space=self.id, ticket=number)
+
+    def create_association(self, number, association):
+        return self._api.create_association(association, space=self.id,
+                ticket=number)
+
     def create_ticket(self, ticket):
         return self._api.create_ticket(ticket, space=self.id)
 
@@ -131,6 +231,12 @@ class InstantMessenger(Model):
 
 class User(Model):
 
+    def _hydrate(self, name, raw):
+        value = Model._hydrate(self, name, raw)
+        if name == 'im' or name == 'im2':
+            value = InstantMessenger.parse(self._api, value)
+        return value
+
     @classmethod
     def parse(cls, api, json):
         user = cls(api)
@@ -155,6 +261,12 @@ class User(Model):
 
 class Ticket(Model):
 
+    converters = {
+        'created_on': parse_datetime,
+        'updated_at': parse_datetime,
+        'completed_date': parse_datetime,
+    }
+
     @classmethod
     def parse(cls, api, json):
         ticket = cls(api)
@@ -192,13 +304,21 @@ class Ticket(Model):
     def create_association(self, association):
         return self._api.create_association(association, space=self.space_id, ticket=self.number)
 
-    def get_comments(self):
-        return list(Cursor(self._api.get_ticket_comments, space=self.space_id, ticket=self.number).items())
+    def get_comments(self, prefetch=2):
+        return list(self.iter_comments(prefetch=prefetch))
+
+    def iter_comments(self, per_page=None, prefetch=1, **filters):
+        """Yield comments while pages of per_page are listed"""
+        return Cursor(self._api.get_ticket_comments, space=self.space_id,
+                ticket=self.number, per_page=per_page, **filters).items(
+                prefetch=prefetch)
 
     def create_comment(self, comment):
         return self._api.create_ticket_comment(comment, space=self.space_id, ticket=self.number)
 
     def attach_file(self, filecontent, docmeta):
+        # documents may be shared (cached or coalesced), never modify them
+        docmeta = copy.copy(docmeta)
         docmeta.attachable_id = self.id
         return self._api.create_document(filecontent, docmeta, space=self.space_id)
 
@@ -214,6 +334,22 @@ class Ticket(Model):
 
 class TicketComment(Model):
 
+    converters = {
+        'created_on': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+    derived = ('file', 'comment')
+
+    def _hydrate(self, name, raw):
+        if name == 'file':
+            v = raw.get('comment')
+            if v and ('[[file' in v or '[[image' in v):
+                return parse_file(v)
+            return None
+        if name == 'comment':
+            return raw.get('comment')
+        return Model._hydrate(self, name, raw)
+
     @classmethod
     def parse(cls, api, json):
         comment = cls(api)
@@ -236,6 +372,11 @@ class TicketComment(Model):
 
 class TicketCustomField(Model):
 
+    converters = {
+        'created_on': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+
     @classmethod
     def parse(cls, api, json):
         customfield = cls(api)
@@ -276,6 +417,14 @@ class TicketComponent(Model):
 
 class TicketAssociation(Model):
 
+    converters = {
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+
+    # relationships seen from the other ticket
+    INVERSE = {0: 1, 1: 0, 7: 8, 8: 7}
+
     @classmethod
     def parse(cls, api, json):
         association = cls(api)
@@ -293,21 +442,20 @@ class TicketAssociation(Model):
 
     def invert(self):
         tmp = self.ticket1_id
-        self.ticket2_id = self.ticket1_id
-        self.ticket1_id = tmp
-        if self.relationship == 0:
-            self.relationship = 1
-        elif self.relationship == 1:
-            self.relationship = 0
-        elif self.relationship == 7:
-            self.relationship = 8
-        elif self.relationship == 8:
-            self.relationship = 7
+        self.ticket1_id = self.ticket2_id
+        self.ticket2_id = tmp
+        self.relationship = self.INVERSE.get(self.relationship,
+                self.relationship)
 
 
 
 class TicketStatus(Model):
 
+    converters = {
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+
     @classmethod
     def parse(cls, api, json):
         status = cls(api)
@@ -325,13 +473,20 @@ class TicketStatus(Model):
 
 class Milestone(Model):
 
+    converters = {
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+        'completed_date': parse_date,
+        'due_date': parse_date,
+    }
+
     @classmethod
     def parse(cls, api, json):
         milestone = cls(api)
         for k, v in json.items():
             if (k == 'created_at' or k == 'updated_at') and v:
                 setattr(milestone, k, parse_datetime(v))
-            if (k == 'completed_date' or k == 'due_date') and v:
+            elif (k == 'completed_date' or k == 'due_date') and v:
                 setattr(milestone, k, parse_date(v))
             else:
                 setattr(milestone, k, v)
@@ -345,6 +500,11 @@ class Milestone(Model):
 
 class Document(Model):
 
+    converters = {
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+
     @classmethod
     def parse(cls, api, json):
         document = cls(api)
@@ -363,6 +523,12 @@ class Document(Model):
 
 class MergeRequest(Model):
 
+    converters = {
+        'applied_at': parse_datetime,
+        'created_at': parse_datetime,
+        'updated_at': parse_datetime,
+    }
+
     @classmethod
     def parse(cls, api, json):
         mergerequest = cls(api)
@@ -381,6 +547,10 @@ class MergeRequest(Model):
 
 class JSONModel(Model):
 
+    @classmethod
+    def lazy(cls):
+        return cls
+
     @classmethod
     def parse(cls, api, json):
         return json
@@ -388,6 +558,10 @@ class JSONModel(Model):
 
 class IDModel(Model):
 
+    @classmethod
+    def lazy(cls):
+        return cls
+
     @classmethod
     def parse(cls, api, json):
         if isinstance(json, list):
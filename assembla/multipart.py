@@ -0,0 +1,116 @@
+from assembla.utils import convert_to_utf8_str
+from assembla.HttpClient import discard
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FileChunks(object):
+    """Chunks of a streamed response or file, close() closes the source"""
+
+    def __init__(self, content):
+        self.content = content
+        if hasattr(content, 'iter_content'):
+            self._chunks = content.iter_content(CHUNK_SIZE)
+        else:
+            self._chunks = iter(lambda: content.read(CHUNK_SIZE), '')
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._chunks.next()
+
+    def close(self):
+        if hasattr(self.content, 'iter_content'):
+            discard(self.content)
+        else:
+            self.content.close()
+
+
+class MultipartEncoder(object):
+    """
+    multipart/form-data body produced while it is being sent.
+
+    The file part is read chunk by chunk from `chunks`, so only one chunk
+    is held in memory whatever the file size. When `size` (the file
+    length) is known the body has a `len`, which requests sends as
+    Content-Length; otherwise the body is sent with chunked encoding.
+
+    A body is read once per attempt, `reopen` (returning new chunks of the
+    same file) lets rewind() start it over when a request is retried.
+    """
+
+    BOUNDARY = '4079f119cf48'
+
+    def __init__(self, name, filename, chunks, fields=(), size=None,
+            reopen=None):
+        boundary = '--' + self.BOUNDARY
+        self.head = '\r\n'.join([
+            boundary,
+            'Content-Disposition: form-data; name="%s"; filename="%s"' % (
+                name, convert_to_utf8_str(filename)),
+            'Content-Type: application/octet-stream',
+            '', ''])
+        tail = ['']
+        for k, v in fields:
+            tail.append(boundary)
+            tail.append('Content-Disposition: form-data; name="%s"' % k)
+            tail.append('')
+            tail.append(convert_to_utf8_str(v))
+        tail.append(boundary + '--')
+        tail.append('')
+        self.tail = '\r\n'.join(tail)
+        self.chunks = chunks
+        self.reopen = reopen
+        self.started = False
+        if size is not None:
+            self.len = len(self.head) + size + len(self.tail)
+        self.content_type = 'multipart/form-data; boundary=%s' % self.BOUNDARY
+        self._parts = self._generate()
+        self._buffer = ''
+
+    def _generate(self):
+        self.started = True
+        yield self.head
+        for chunk in self.chunks:
+            if chunk:
+                yield chunk
+        yield self.tail
+
+    def __iter__(self):
+        return self._parts
+
+    def rewind(self):
+        """Start the body over, False if it cannot be sent again"""
+        if not self.started:
+            return True
+        if self.reopen is None:
+            return False
+        self.close()
+        try:
+            self.chunks = self.reopen()
+        except Exception:
+            return False
+        self.started = False
+        self._parts = self._generate()
+        self._buffer = ''
+        return True
+
+    def close(self):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+    def read(self, size=-1):
+        """File-like access, used by httplib when Content-Length is known"""
+        if size is None or size < 0:
+            data = self._buffer + ''.join(self._parts)
+            self._buffer = ''
+            return data
+        while len(self._buffer) < size:
+            try:
+                self._buffer += self._parts.next()
+            except StopIteration:
+                break
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
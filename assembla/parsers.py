@@ -1,9 +1,86 @@
+import re
 
 from assembla.models import ModelFactory
 from assembla.utils import import_simplejson
 from assembla.error import AssemblaError
 
 
+class JSONArrayReader(object):
+    """
+    Iterate over the elements of a top level JSON array while it is read
+    from `chunks`, only the current element is buffered. When the document
+    is not an array it is decoded whole into `document` instead.
+    """
+
+    TOKENS = re.compile(r'[\[\]{}",]')
+    STRING_TOKENS = re.compile(r'["\\]')
+
+    def __init__(self, chunks, loads):
+        self.chunks = chunks
+        self.loads = loads
+        self.document = None
+
+    def __iter__(self):
+        chunks = iter(self.chunks)
+        buf = ''
+        for chunk in chunks:
+            buf += chunk
+            if buf.strip():
+                break
+        if not buf.lstrip().startswith('['):
+            rest = buf + ''.join(chunks)
+            if rest.strip():
+                self.document = self.loads(rest)
+            return
+
+        depth = 0
+        in_string = False
+        start = pos = buf.index('[')
+        while True:
+            while True:
+                if in_string:
+                    m = self.STRING_TOKENS.search(buf, pos)
+                    if m is None:
+                        pos = len(buf)
+                        break
+                    if m.group() == '"':
+                        in_string = False
+                        pos = m.end()
+                    elif m.end() < len(buf):
+                        pos = m.end() + 1 # skip the escaped character
+                    else:
+                        pos = m.start() # wait for the escaped character
+                        break
+                    continue
+                m = self.TOKENS.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                token, pos = m.group(), m.end()
+                if token == '"':
+                    in_string = True
+                elif token in '[{':
+                    depth += 1
+                    if depth == 1:
+                        start = pos
+                elif token in ']}':
+                    depth -= 1
+                    if depth == 0:
+                        element = buf[start:m.start()]
+                        if element.strip():
+                            yield self.loads(element)
+                        return
+                elif depth == 1:
+                    yield self.loads(buf[start:m.start()])
+                    start = pos
+            # drop what was already decoded
+            buf, pos, start = buf[start:], pos - start, 0
+            try:
+                buf += chunks.next()
+            except StopIteration:
+                raise ValueError('Truncated JSON array')
+
+
 class Parser(object):
 
     def parse(self, method, payload):
@@ -55,6 +132,17 @@ class JSONParser(Parser):
         else:
             return json
 
+    def parse_stream(self, method, chunks):
+        """Decode the elements of a list response while reading it"""
+        reader = JSONArrayReader(chunks, self.json_lib.loads)
+        try:
+            for obj in reader:
+                yield obj
+        except ValueError, e:
+            raise AssemblaError('Failed to parse JSON payload: %s' % e)
+        if reader.document is not None:
+            yield reader.document
+
     def parse_error(self, payload):
         error = self.json_lib.loads(payload)
         if error.has_key('error'):
@@ -65,9 +153,17 @@ class JSONParser(Parser):
 
 class ModelParser(JSONParser):
 
-    def __init__(self, model_factory=None):
+    def __init__(self, model_factory=None, lazy=False):
         JSONParser.__init__(self)
         self.model_factory = model_factory or ModelFactory
+        # wrap the json in the models, converting fields on first access
+        self.lazy = lazy
+        if lazy:
+            # e.g. the compact models, they are always parsed eagerly
+            for name in dir(self.model_factory):
+                model = getattr(self.model_factory, name)
+                if hasattr(model, 'parse') and not hasattr(model, 'lazy'):
+                    raise AssemblaError('The %s models of %s can not be parsed lazily' % (name, self.model_factory.__name__))
 
     def parse(self, method, payload):
         try:
@@ -75,6 +171,8 @@ class ModelParser(JSONParser):
             model = getattr(self.model_factory, method.payload_type)
         except AttributeError:
             raise AssemblaError('No model for this payload type: %s' % method.payload_type)
+        if self.lazy:
+            model = model.lazy()
 
         json = JSONParser.parse(self, method, payload)
         if isinstance(json, tuple):
@@ -92,3 +190,21 @@ class ModelParser(JSONParser):
         else:
             return result
 
+    def parse_stream(self, method, chunks):
+        """Yield models as each element of a list response is read"""
+        model = getattr(self.model_factory, method.payload_type)
+        if self.lazy:
+            model = model.lazy()
+        reader = JSONArrayReader(chunks, self.json_lib.loads)
+        try:
+            for obj in reader:
+                # skipped like Model.parse_list does
+                if not obj:
+                    continue
+                yield model.parse(method.api, obj)
+        except ValueError, e:
+            raise AssemblaError('Failed to parse JSON payload: %s' % e)
+        if reader.document is not None:
+            # not an array, e.g. wrapped in an object
+            for item in model.parse_list(method.api, reader.document):
+                yield item
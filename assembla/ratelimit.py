@@ -0,0 +1,94 @@
+import time
+import random
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+
+def backoff(attempt, base, cap=60.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread using a HttpClient.
+
+    `rate` is the target number of requests per second (None for no client
+    side pacing) and `burst` the bucket size. The rate is halved whenever
+    the server throttles and grows back towards the target on successes.
+    A Retry-After or exhausted rate limit pauses every caller.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=0.5):
+        self.target = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.min_rate = min_rate
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.time()
+                wait = self.paused_until - now
+                if wait <= 0 and self.rate:
+                    self.tokens = min(self.burst,
+                            self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                elif wait <= 0:
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2.0)
+                self.tokens = min(self.tokens, 0)
+        if retry_after is not None:
+            self.pause(retry_after)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate and self.rate < self.target:
+                self.rate = min(self.target, self.rate + 0.1 * self.target)
+
+    def update(self, headers):
+        """Pause until reset once the server reports no requests left"""
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining, reset = int(remaining), float(reset)
+        except ValueError:
+            return
+        if remaining <= 0:
+            # either an epoch timestamp or seconds until reset
+            if reset > 1e9:
+                reset -= time.time()
+            self.pause(reset)
@@ -0,0 +1,185 @@
+"""
+Spans of the migration phases and API calls, written as Chrome trace
+events (open the file in https://ui.perfetto.dev or chrome://tracing).
+Spans on the same thread nest by time, so a ticket's comments, documents
+and API calls show up below its copy_ticket span.
+
+Nothing is recorded until tracing is started, e.g. TRACER.start(filename)
+... TRACER.stop().
+"""
+import os
+import json
+import time
+import threading
+from functools import wraps
+
+
+class NullSpan(object):
+    """Returned while tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.cat, self.start, time.time(),
+                self.args)
+        return False
+
+    def set(self, key, value):
+        self.args[key] = value
+
+
+class Tracer(object):
+    """
+    Collects complete ('X') events, at most `limit` at a time. Started
+    with a file the buffer is appended to it whenever it fills up,
+    otherwise later spans are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, limit=10000):
+        self.lock = threading.Lock()
+        self.limit = limit
+        self.enabled = False
+        self.out = None
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.epoch = time.time()
+            self.events = []
+            self.threads = {}
+            self.dropped = 0
+            self.written = 0
+
+    def start(self, filename):
+        """Record spans, streaming them to filename (JSON array format)"""
+        self.reset()
+        self.out = open(filename, 'w')
+        self.out.write('[')
+        self.enable()
+
+    def stop(self):
+        """Stop recording, finish the file given to start()"""
+        self.disable()
+        if self.out is None:
+            return
+        with self.lock:
+            self.dump(self.metadata() + self.complete())
+            self.events = []
+            self.out.write('\n]\n')
+            self.out.close()
+            self.out = None
+
+    def span(self, name, cat='atmt', **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def traced(self, name=None, cat='atmt', args=None):
+        """
+        Decorator running the function in a span, `args` maps the call's
+        arguments to the span's arguments, e.g. the ticket number.
+        """
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*a, **k):
+                if not self.enabled:
+                    return func(*a, **k)
+                with self.span(span_name, cat, **(args(*a, **k) if args
+                        else {})):
+                    return func(*a, **k)
+            return wrapper
+        return decorator
+
+    def add(self, name, cat, start, end, args):
+        thread = threading.current_thread()
+        with self.lock:
+            if len(self.events) >= self.limit:
+                if self.out is None:
+                    self.dropped += 1
+                    return
+                self.flush()
+            tid = self.threads.get(thread.ident)
+            if tid is None:
+                tid = self.threads[thread.ident] = (len(self.threads) + 1,
+                        thread.name)
+            self.events.append((name, cat, start, end, tid[0], args))
+
+    def flush(self):
+        # called with the lock held
+        self.dump(self.complete())
+        self.events = []
+
+    def dump(self, events):
+        for event in events:
+            if self.written:
+                self.out.write(',')
+            self.out.write('\n' + json.dumps(event, default=str))
+            self.written += 1
+
+    def complete(self):
+        pid = os.getpid()
+        return [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid,
+                'tid': tid, 'ts': int((start - self.epoch) * 1e6),
+                'dur': int((end - start) * 1e6), 'args': args}
+                for name, cat, start, end, tid, args in self.events]
+
+    def metadata(self):
+        pid = os.getpid()
+        trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                'args': {'name': 'ATMT'}}]
+        for tid, thread_name in sorted(self.threads.values()):
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                    'tid': tid, 'args': {'name': thread_name}})
+            trace.append({'name': 'thread_sort_index', 'ph': 'M',
+                    'pid': pid, 'tid': tid, 'args': {'sort_index': tid}})
+        if self.dropped:
+            trace[0]['args']['dropped_spans'] = self.dropped
+        return trace
+
+    def trace_events(self):
+        """Buffered spans and thread names as trace event dicts"""
+        with self.lock:
+            return self.metadata() + self.complete()
+
+    def write(self, filename):
+        """Write the buffered spans when recording without start()"""
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(),
+                    'displayTimeUnit': 'ms'}, f, default=str)
+
+
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+import cookielib
+import requests
+
+from assembla.error import AssemblaError
+from assembla.HttpClient import mount_pool, pool_stats, discard
+from assembla.ratelimit import parse_retry_after, backoff
+
+
+class WebSession(object):
+    """
+    Logged in www.assembla.com session, documents are only downloadable
+    from the website. One login is shared by every download and thread,
+    cookies are kept in `cookie_file` between runs and the login form is
+    only submitted again once the session expired.
+    Documents are read through `blobs` (a BlobStore) when given.
+    """
+
+    LOGIN_URL = 'https://www.assembla.com/do_login'
+    RETRY_CODES = [429, 502, 503, 504]
+
+    def __init__(self, username, password, cookie_file=None, blobs=None,
+            pool_maxsize=10, timeout=None, retry_count=3, retry_delay=1):
+        self.username = username
+        self.password = password
+        self.cookie_file = cookie_file
+        self.blobs = blobs
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.timeout = timeout
+        self.retry_count = retry_count
+        self.retry_delay = retry_delay
+        self.client = requests.Session()
+        self.pool_maxsize = pool_maxsize
+        mount_pool(self.client, maxsize=pool_maxsize)
+        self.load_cookies()
+
+    def load_cookies(self):
+        if not self.cookie_file or not os.path.exists(self.cookie_file):
+            return False
+        # whole cookies, so each is only sent to its own domain and path
+        jar = cookielib.LWPCookieJar()
+        try:
+            jar.load(self.cookie_file, ignore_discard=True,
+                    ignore_expires=False)
+        except (cookielib.LoadError, IOError):
+            return False
+        if not len(jar):
+            return False
+        for cookie in jar:
+            self.client.cookies.set_cookie(cookie)
+        # assume valid until a download proves otherwise
+        self.logins = 1
+        return True
+
+    def save_cookies(self):
+        if not self.cookie_file:
+            return
+        jar = cookielib.LWPCookieJar()
+        for cookie in self.client.cookies:
+            jar.set_cookie(cookie)
+        fd = os.open(self.cookie_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                0600)
+        with os.fdopen(fd, 'w') as f:
+            # the session cookie has no expiry, it is kept (ignore_discard)
+            # until the website rejects it
+            f.write('#LWP-Cookies-2.0\n')
+            f.write(jar.as_lwp_str(ignore_discard=True, ignore_expires=False))
+
+    def login(self, seen=None):
+        """
+        Submit the login form, unless another thread already logged in
+        since `seen` (the login count observed by the caller).
+        """
+        from lxml.html import fromstring, submit_form
+        with self.lock:
+            if seen is not None and self.logins != seen:
+                return
+            login_form = fromstring(self.client.get(self.LOGIN_URL).content).forms[0]
+            login_form.fields['user[login]'] = self.username
+            login_form.fields['user[password]'] = self.password
+            login_response = submit_form(login_form, open_http=self.client.request)
+            if login_response.status_code != 200:
+                raise AssemblaError('Failed on file download, status: %s' % login_response.status_code, response=login_response)
+            self.logins += 1
+            self.save_cookies()
+
+    @staticmethod
+    def expired(response):
+        # anonymous requests are redirected to the login page
+        return response.status_code in (401, 403) or \
+                (response.history and 'login' in response.url)
+
+    def resize_pool(self, maxsize):
+        if maxsize > self.pool_maxsize:
+            self.pool_maxsize = maxsize
+            mount_pool(self.client, maxsize=maxsize)
+
+    def pool_stats(self):
+        return pool_stats(self.client)
+
+    def get(self, url, **kargs):
+        if self.timeout is not None:
+            kargs.setdefault('timeout', self.timeout)
+        seen = self.logins
+        if not seen:
+            self.login(seen)
+            seen = self.logins
+        response = self.client.get(url, **kargs)
+        if self.expired(response):
+            discard(response)
+            self.login(seen)
+            response = self.client.get(url, **kargs)
+            # still the login page, e.g. the credentials were rejected
+            if self.expired(response):
+                discard(response)
+                raise AssemblaError('Failed on file download, login was not accepted', response=response)
+        retries = 0
+        while response.status_code in self.RETRY_CODES and \
+                retries < self.retry_count:
+            discard(response)
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            if retry_after is None:
+                retry_after = backoff(retries, self.retry_delay)
+            time.sleep(retry_after)
+            retries += 1
+            response = self.client.get(url, **kargs)
+        if response.status_code != 200:
+            raise AssemblaError('Failed on file download, status: %s' % response.status_code, response=response)
+        return response
+
+    def open_document(self, document):
+        """Return a streamed response or file with the document content"""
+        if self.blobs:
+            return self.blobs.open(document, self)
+        return self.get(document.url, stream=True)
@@ -0,0 +1,215 @@
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from Queue import Queue
+
+
+class Future(object):
+    """Placeholder for the result of a job submitted to a WorkerPool"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def add_done_callback(self, func):
+        """Call func(future) once done, from the thread completing it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        # Event.wait without a timeout can not be interrupted on python 2
+        while not self._event.wait(timeout or 0.5):
+            if timeout:
+                break
+        return self._event.is_set()
+
+    def exception(self):
+        self.wait()
+        if self._exc_info:
+            return self._exc_info[1]
+
+    def result(self):
+        self.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class SingleFlight(object):
+    """
+    Identical calls (same key) made while one is in flight wait for it and
+    share its result or exception instead of running again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            _run(future, func, args, kargs)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+    def stats(self):
+        return {'executed': self.executed, 'coalesced': self.coalesced}
+
+
+def _run(future, func, args, kargs):
+    try:
+        result = func(*args, **kargs)
+    except Exception:
+        future.set_exc_info(sys.exc_info())
+    else:
+        future.set_result(result)
+
+
+def spawn(func, *args, **kargs):
+    """Run func(*args, **kargs) in a new daemon thread, return a Future"""
+    future = Future()
+    t = threading.Thread(target=_run, args=(future, func, args, kargs))
+    t.daemon = True
+    t.start()
+    return future
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads.
+    A pool of size 1 (or less) runs every job inline in the calling thread,
+    so do jobs submitted from one of the pool's own workers: a worker
+    waiting on jobs queued behind it could otherwise take every worker and
+    deadlock the pool.
+    """
+
+    def __init__(self, size=1, name='ATMT-worker'):
+        self.size = size
+        self.name = name
+        self.threads = []
+        self.jobs = Queue()
+        self.local = threading.local()
+        if self.size > 1:
+            for i in range(self.size):
+                t = threading.Thread(target=self._worker,
+                        name='%s-%s' % (name, i))
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def _worker(self):
+        self.local.worker = True
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            _run(*job)
+
+    def submit(self, func, *args, **kargs):
+        """Schedule func(*args, **kargs), return a Future"""
+        future = Future()
+        if self.threads and not getattr(self.local, 'worker', False):
+            self.jobs.put((future, func, args, kargs))
+        else:
+            _run(future, func, args, kargs)
+        return future
+
+    def imap(self, func, iterable, window=None):
+        """
+        Apply func to every item, yielding (item, future) pairs in input
+        order. At most `window` jobs (default twice the pool size) are
+        scheduled ahead of the consumer.
+        """
+        window = window or max(self.size, 1) * 2
+        pending = deque()
+        for item in iterable:
+            pending.append((item, self.submit(func, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                future.wait()
+                yield item, future
+        while pending:
+            item, future = pending.popleft()
+            future.wait()
+            yield item, future
+
+    def shutdown(self, wait=True):
+        for t in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for t in self.threads:
+                t.join()
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+# the pool AsyncAPI instances run on by default
+SHARED_POOL_SIZE = 32
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """
+    The process wide WorkerPool of SHARED_POOL_SIZE threads, started on
+    first use (again after a shutdown). Its size bounds the jobs running
+    at once for everything submitting to it.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None or not _shared.threads:
+            _shared = WorkerPool(SHARED_POOL_SIZE, name='ATMT-shared')
+        return _shared
+
+
+@contextmanager
+def pool_for(size, pool=None):
+    """Use `pool` as is if given, otherwise a new pool of `size` threads"""
+    if pool is not None:
+        yield pool
+    else:
+        with WorkerPool(size) as pool:
+            yield pool
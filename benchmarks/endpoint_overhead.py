@@ -0,0 +1,63 @@
+"""
+Client side cost of an API call, binding the endpoint on every call (as
+the create_* methods used to) against the endpoints bound at import.
+
+    python benchmarks/endpoint_overhead.py [calls]
+
+Requests never leave the process: the HTTP client returns a canned
+response, so the timings are binding, path building and parsing only.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from assembla import API
+from assembla.binder import bind_api
+from assembla.models import TicketComment
+
+
+class Response(object):
+    status_code = 201
+    headers = {}
+    content = '{"id": 1, "comment": "text", "user_id": "u", "ticket_id": 2}'
+
+
+def respond(url, **kargs):
+    return Response()
+
+
+def create_ticket_comment_per_call(api, comment, *args, **kargs):
+    kargs['post_data'] = comment.toJSON()
+    return bind_api(
+        path='spaces/{space}/tickets/{ticket}/ticket_comments.json',
+        method='POST',
+        payload_type='ticketcomment',
+        allowed_params = ['space', 'ticket']
+    )(api, *args, **kargs)
+
+
+def run(name, create, api, comment, calls):
+    start = time.time()
+    for i in xrange(calls):
+        create(comment, space='space', ticket=i)
+    elapsed = time.time() - start
+    print '%-10s %8d calls %8.2f us/call' % (name, calls,
+            elapsed * 1e6 / calls)
+    return elapsed
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    api = API('key', 'secret')
+    api.initTokens('access', 'refresh')
+    api.client.POST = respond
+    comment = TicketComment()
+    comment.comment = 'text'
+
+    per_call = run('per call', lambda c, **k:
+            create_ticket_comment_per_call(api, c, **k), api, comment, calls)
+    compiled = run('compiled', api.create_ticket_comment, api, comment, calls)
+    print 'compiled endpoints take %.0f%% of the time' % (
+            100.0 * compiled / per_call)
@@ -0,0 +1,603 @@
+"""
+Local stand-in for the Assembla API (and the website document downloads)
+implementing the endpoints used by assembla/api.py.
+
+The `source` space is generated from ticket numbers on request, so seeding
+100k tickets costs no memory, the `dest` space starts empty and keeps what
+is created in it. Latency, error rate and 429 throttling are configurable.
+
+    python benchmarks/fakeassembla.py --tickets 10000 --latency 0.02 --port 8000
+
+Point an API at it with API(key, secret, host='127.0.0.1:8000').
+"""
+import re
+import sys
+import time
+import json
+import random
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+
+MAX_PER_PAGE = 100
+DEFAULT_PER_PAGE = 10
+EPOCH = '2013-03-01T10:00:00Z'
+
+
+class SourceSpace(object):
+    """Space generated from the seed parameters, tickets can be deleted"""
+
+    def __init__(self, id, tickets, comments, documents, document_size,
+            milestones=20, components=10):
+        self.id = id
+        self.name = id
+        self.count = tickets
+        self.comments_per_ticket = comments
+        self.documents_per_ticket = documents
+        self.document_size = document_size
+        self.deleted = set()
+        self.statuses = [self.status(i, name) for i, name in
+                enumerate(['New', 'Accepted', 'Test', 'Fixed', 'Invalid'])]
+        self.fields = [{'id': 'f1', 'title': 'Type', 'type': 'List',
+                'list_options': ['Bug', 'Feature'], 'space_tool_id': 't1',
+                'required': False, 'hide': False, 'default_value': 'Bug',
+                'order': 1, 'created_on': EPOCH, 'updated_at': EPOCH}]
+        self.components = [{'id': 'c%d' % i, 'name': 'Component %d' % i}
+                for i in range(components)]
+        self.milestones = [{'id': 'm%d' % i, 'title': 'Milestone %d' % i,
+                'space_id': id, 'is_completed': False, 'created_at': EPOCH,
+                'updated_at': EPOCH, 'due_date': None, 'completed_date': None}
+                for i in range(milestones)]
+
+    def status(self, i, name):
+        return {'id': 's%d' % i, 'name': name, 'state': int(i < 3),
+                'list_order': i, 'space_tool_id': 't1',
+                'created_at': EPOCH, 'updated_at': EPOCH}
+
+    def ticket_id(self, number):
+        return 1000000 + number
+
+    def ticket(self, number):
+        if not 1 <= number <= self.count or number in self.deleted:
+            return None
+        return {
+            'id': self.ticket_id(number), 'number': number,
+            'summary': 'Generated ticket %d' % number,
+            'description': 'Follow-up of #%d\n\n%s' % (number - 1,
+                'Lorem ipsum dolor sit amet. ' * 8),
+            'space_id': self.id, 'priority': 3, 'state': 1, 'status': 'New',
+            'milestone_id': self.milestones[number % len(self.milestones)]['id'],
+            'component_id': self.components[number % len(self.components)]['id'],
+            'reporter_id': 'user1', 'assigned_to_id': None,
+            'created_on': EPOCH, 'updated_at': EPOCH, 'completed_date': None,
+            'importance': 0.0, 'is_story': False, 'permission_type': 1,
+            'custom_fields': {'Type': 'Bug'}, 'hierarchy_type': 0,
+        }
+
+    def tickets(self, start, stop):
+        tickets = [self.ticket(n) for n in range(start + 1,
+                min(stop, self.count) + 1)]
+        return [t for t in tickets if t]
+
+    def delete_ticket(self, number):
+        ticket = self.ticket(number)
+        if ticket:
+            self.deleted.add(number)
+        return ticket
+
+    def ticket_by_id(self, id):
+        return self.ticket(id - 1000000)
+
+    def document_id(self, number, i):
+        return 'd%dx%d' % (number, i)
+
+    def comments(self, number):
+        if self.ticket(number) is None:
+            return None
+        comments = []
+        for j in range(self.comments_per_ticket):
+            comment = {'id': number * 1000 + j, 'user_id': 'user1',
+                    'ticket_id': self.ticket_id(number), 'created_on': EPOCH,
+                    'updated_at': EPOCH, 'rendered': None,
+                    'comment': 'Comment %d on #%d' % (j, number),
+                    'ticket_changes': None}
+            if j == 0:
+                # system comment, only ticket changes
+                comment['comment'] = ''
+                comment['ticket_changes'] = \
+                        '---\n- - status\n  - New\n  - Accepted\n'
+            comments.append(comment)
+        for i in range(self.documents_per_ticket):
+            comments.append({'id': number * 1000 + 500 + i,
+                    'user_id': 'user1', 'ticket_id': self.ticket_id(number),
+                    'created_on': EPOCH, 'updated_at': EPOCH,
+                    'comment': '[[file:%s]]' % self.document_id(number, i),
+                    'ticket_changes': None, 'rendered': None})
+        return comments
+
+    def associations(self, number):
+        # tickets are chained in groups of ten
+        if self.ticket(number) is None:
+            return None
+        result = []
+        for a, b in ((number - 1, number), (number, number + 1)):
+            if a % 10 and self.ticket(a) and self.ticket(b):
+                result.append({'id': a, 'ticket1_id': self.ticket_id(a),
+                        'ticket2_id': self.ticket_id(b), 'relationship': 0,
+                        'created_at': EPOCH, 'updated_at': EPOCH})
+        return result
+
+    def document(self, id, base_url):
+        m = re.match(r'^d(\d+)x(\d+)$', id)
+        if not m or self.ticket(int(m.group(1))) is None:
+            return None
+        return {'id': id, 'name': 'file-%s.bin' % id,
+                'filename': 'file-%s.bin' % id, 'filesize': self.document_size,
+                'content_type': 'application/octet-stream',
+                'url': '%s/download/%s' % (base_url, id),
+                'attachable_type': 'Ticket', 'space_id': self.id,
+                'attachable_id': self.ticket_id(int(m.group(1))),
+                'created_at': EPOCH, 'updated_at': EPOCH}
+
+    def content(self, id):
+        return (id * (self.document_size // len(id) + 1))[:self.document_size]
+
+
+class Space(object):
+    """Space keeping what is created in it"""
+
+    def __init__(self, id):
+        self.id = id
+        self.name = id
+        self.lock = threading.Lock()
+        self.by_number = {}
+        self.by_id = {}
+        self.next_id = 5000000
+        self.next_number = 1
+        self.statuses = []
+        self.fields = []
+        self.components = []
+        self.milestones = []
+        self.comment_count = {}
+        self.association_list = {}
+        self.document_count = 0
+        self.document_bytes = 0
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def add(self, collection, data, **fields):
+        with self.lock:
+            data = dict(data, id=self.new_id(), **fields)
+            collection.append(data)
+            return data
+
+    def create_ticket(self, data):
+        with self.lock:
+            number = data.get('number') or self.next_number
+            if number in self.by_number:
+                return None
+            ticket = {'id': self.new_id(), 'number': number,
+                    'summary': data.get('summary'), 'space_id': self.id,
+                    'created_on': EPOCH, 'updated_at': EPOCH}
+            self.by_number[number] = self.by_id[ticket['id']] = ticket
+            self.next_number = max(self.next_number, number + 1)
+            return ticket
+
+    def delete_ticket(self, number):
+        with self.lock:
+            ticket = self.by_number.pop(number, None)
+            if ticket:
+                del self.by_id[ticket['id']]
+            return ticket
+
+    def ticket(self, number):
+        return self.by_number.get(number)
+
+    def ticket_by_id(self, id):
+        return self.by_id.get(id)
+
+    def tickets(self, start, stop):
+        with self.lock:
+            numbers = sorted(self.by_number)[start:stop]
+            return [self.by_number[n] for n in numbers]
+
+    def comments(self, number):
+        # comments are only counted, listings of the destination are empty
+        return [] if number in self.by_number else None
+
+    def create_comment(self, number, data):
+        with self.lock:
+            self.comment_count[number] = self.comment_count.get(number, 0) + 1
+            return dict(data, id=self.new_id(), ticket_id=
+                    self.by_number[number]['id'])
+
+    def associations(self, number):
+        if number not in self.by_number:
+            return None
+        return self.association_list.get(self.by_number[number]['id'], [])
+
+    def create_association(self, data):
+        with self.lock:
+            data = dict(data, id=self.new_id())
+            for id in (data.get('ticket1_id'), data.get('ticket2_id')):
+                self.association_list.setdefault(id, []).append(data)
+            return data
+
+    def create_document(self, size):
+        with self.lock:
+            self.document_count += 1
+            self.document_bytes += size
+            return {'id': 'n%d' % self.new_id(), 'name': 'upload',
+                    'filesize': size, 'created_at': EPOCH}
+
+    def document(self, id, base_url):
+        return None
+
+
+class Throttle(object):
+    """Token bucket, requests over `rate` per second get a 429"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                    self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FakeAssembla(object):
+
+    def __init__(self, tickets=1000, comments=5, documents=1,
+            document_size=16 * 1024, latency=0.0, jitter=0.5,
+            error_rate=0.0, rate_limit=None):
+        self.spaces = {
+            'source': SourceSpace('source', tickets, comments, documents,
+                document_size),
+            'dest': Space('dest'),
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = Throttle(rate_limit) if rate_limit else None
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0,
+                'bytes_in': 0, 'bytes_out': 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(1 - self.jitter,
+                    1 + self.jitter))
+
+
+def page_bounds(query):
+    per_page = min(int(query.get('per_page', DEFAULT_PER_PAGE)), MAX_PER_PAGE)
+    page = max(int(query.get('page', 1)), 1)
+    return (page - 1) * per_page, page * per_page
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # one write per response, small writes stall on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ('GET', r'^/v1/user\.json$', 'me'),
+        ('GET', r'^/v1/spaces\.json$', 'spaces'),
+        ('GET', r'^/v1/spaces/(\w+)/users\.json$', 'users'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets\.json$', 'tickets'),
+        ('POST', r'^/v1/spaces/(\w+)/tickets\.json$', 'create_ticket'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/(\d+)\.json$', 'ticket'),
+        ('DELETE', r'^/v1/spaces/(\w+)/tickets/(\d+)\.json$', 'delete_ticket'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/id/(\d+)\.json$', 'ticket_by_id'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/statuses\.json$', 'statuses'),
+        ('POST', r'^/v1/spaces/(\w+)/tickets/statuses\.json$', 'create_status'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/custom_fields\.json$', 'fields'),
+        ('POST', r'^/v1/spaces/(\w+)/tickets/custom_fields\.json$', 'create_field'),
+        ('GET', r'^/v1/spaces/(\w+)/ticket_components\.json$', 'components'),
+        ('POST', r'^/v1/spaces/(\w+)/ticket_components\.json$', 'create_component'),
+        ('GET', r'^/v1/spaces/(\w+)/milestones/all\.json$', 'milestones'),
+        ('POST', r'^/v1/spaces/(\w+)/milestones\.json$', 'create_milestone'),
+        ('GET', r'^/v1/spaces/(\w+)/milestones/(\w+)\.json$', 'milestone'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/(\d+)/ticket_comments\.json$', 'comments'),
+        ('POST', r'^/v1/spaces/(\w+)/tickets/(\d+)/ticket_comments\.json$', 'create_comment'),
+        ('GET', r'^/v1/spaces/(\w+)/tickets/(\d+)/ticket_associations\.json$', 'associations'),
+        ('POST', r'^/v1/spaces/(\w+)/tickets/(\d+)/ticket_associations\.json$', 'create_association'),
+        ('GET', r'^/v1/spaces/(\w+)/documents\.json$', 'documents'),
+        ('POST', r'^/v1/spaces/(\w+)/documents\.json$', 'create_document'),
+        ('GET', r'^/v1/spaces/(\w+)/documents/(\w+)\.json$', 'document'),
+        ('GET', r'^/download/(\w+)$', 'download'),
+        ('GET', r'^/do_login$', 'login_form'),
+        ('POST', r'^/do_login$', 'login'),
+        ('GET', r'^/_stats$', 'server_stats'),
+    ]
+    ROUTES = [(m, re.compile(p), name) for m, p, name in ROUTES]
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def base_url(self):
+        return 'http://%s' % self.headers.get('host')
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def read_body(self):
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+            return ''.join(body)
+        return self.rfile.read(int(self.headers.get('content-length') or 0))
+
+    def send(self, status, data=None, body=None, headers=()):
+        if body is None:
+            body = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        if data is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.fake.count('bytes_out', len(body))
+
+    def dispatch(self, method):
+        fake = self.fake
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        body = self.read_body() if method == 'POST' else ''
+        fake.count('requests')
+        fake.count('bytes_in', len(body))
+        if url.path != '/_stats':
+            if fake.throttle and not fake.throttle.allow():
+                fake.count('throttled')
+                return self.send(429, {'error': 'Rate limit exceeded'},
+                        headers=[('Retry-After', '1')])
+            fake.delay()
+            if fake.error_rate and random.random() < fake.error_rate:
+                fake.count('errors')
+                return self.send(503, {'error': 'Service unavailable'})
+        for route_method, pattern, name in self.ROUTES:
+            m = pattern.match(url.path)
+            if m and route_method == method:
+                args = m.groups()
+                space = None
+                if url.path.startswith('/v1/spaces/'):
+                    space = fake.spaces.get(args[0])
+                    if space is None:
+                        return self.send(404, {'error': 'Space not found'})
+                    args = args[1:]
+                status, data = getattr(self, name)(space, query, body, *args)
+                if isinstance(data, tuple):
+                    return self.send(status, body=data[0], headers=data[1])
+                return self.send(status, data)
+        self.send(404, {'error': 'Not found'})
+
+    # API
+
+    def me(self, space, query, body):
+        return 200, {'id': 'user1', 'login': 'bench', 'name': 'Bench User'}
+
+    def spaces(self, space, query, body):
+        return 200, [{'id': s.id, 'name': s.name, 'wiki_name': s.id}
+                for s in self.fake.spaces.values()]
+
+    def users(self, space, query, body):
+        return 200, [self.me(space, query, body)[1]]
+
+    def tickets(self, space, query, body):
+        return 200, space.tickets(*page_bounds(query))
+
+    def create_ticket(self, space, query, body):
+        if not hasattr(space, 'create_ticket'):
+            return 403, {'error': 'Read only space'}
+        ticket = space.create_ticket(json.loads(body)['ticket'])
+        if ticket is None:
+            return 422, {'errors': {'number': ['has already been taken']}}
+        return 201, ticket
+
+    def found(self, data):
+        if data is None:
+            return 404, {'error': 'Not found'}
+        return 200, data
+
+    def ticket(self, space, query, body, number):
+        return self.found(space.ticket(int(number)))
+
+    def delete_ticket(self, space, query, body, number):
+        if space.delete_ticket(int(number)) is None:
+            return 404, {'error': 'Not found'}
+        return 204, None
+
+    def ticket_by_id(self, space, query, body, id):
+        return self.found(space.ticket_by_id(int(id)))
+
+    def statuses(self, space, query, body):
+        return 200, space.statuses
+
+    def create_status(self, space, query, body):
+        return 201, space.add(space.statuses, json.loads(body)['status'])
+
+    def fields(self, space, query, body):
+        return 200, space.fields
+
+    def create_field(self, space, query, body):
+        field = json.loads(body)['custom_field']
+        if isinstance(field.get('list_options'), basestring):
+            field['list_options'] = field['list_options'].split(',')
+        return 201, space.add(space.fields, field)
+
+    def components(self, space, query, body):
+        return 200, space.components
+
+    def create_component(self, space, query, body):
+        return 201, space.add(space.components,
+                {'name': json.loads(body)['component']})
+
+    def milestones(self, space, query, body):
+        start, stop = page_bounds(query)
+        return 200, space.milestones[start:stop]
+
+    def create_milestone(self, space, query, body):
+        return 201, space.add(space.milestones,
+                json.loads(body)['milestone'], space_id=space.id)
+
+    def milestone(self, space, query, body, id):
+        for m in space.milestones:
+            if str(m['id']) == id:
+                return 200, m
+        return 404, {'error': 'Not found'}
+
+    def comments(self, space, query, body, number):
+        comments = space.comments(int(number))
+        if comments is None:
+            return 404, {'error': 'Not found'}
+        return 200, comments[slice(*page_bounds(query))]
+
+    def create_comment(self, space, query, body, number):
+        if space.ticket(int(number)) is None or \
+                not hasattr(space, 'create_comment'):
+            return 404, {'error': 'Not found'}
+        return 201, space.create_comment(int(number),
+                json.loads(body)['ticket_comment'])
+
+    def associations(self, space, query, body, number):
+        return self.found(space.associations(int(number)))
+
+    def create_association(self, space, query, body, number):
+        if space.ticket(int(number)) is None or \
+                not hasattr(space, 'create_association'):
+            return 404, {'error': 'Not found'}
+        return 201, space.create_association(
+                json.loads(body)['ticket_association'])
+
+    def documents(self, space, query, body):
+        return 200, []
+
+    def create_document(self, space, query, body):
+        if not hasattr(space, 'create_document'):
+            return 403, {'error': 'Read only space'}
+        return 201, space.create_document(len(body))
+
+    def document(self, space, query, body, id):
+        return self.found(space.document(id, self.base_url()))
+
+    # website
+
+    def download(self, space, query, body, id):
+        if 'session=' not in self.headers.get('cookie', ''):
+            return 302, ('', [('Location', self.base_url() + '/do_login')])
+        source = self.fake.spaces['source']
+        if source.document(id, '') is None:
+            return 404, ('', [])
+        return 200, (source.content(id),
+                [('Content-Type', 'application/octet-stream')])
+
+    def login_form(self, space, query, body):
+        form = ('<html><body><form method="post" action="%s/do_login">'
+                '<input name="user[login]"><input name="user[password]" '
+                'type="password"></form></body></html>' % self.base_url())
+        return 200, (form, [('Content-Type', 'text/html')])
+
+    def login(self, space, query, body):
+        return 200, ('', [('Set-Cookie', 'session=%d; Path=/' %
+                random.randint(0, 1 << 30))])
+
+    def server_stats(self, space, query, body):
+        stats = dict(self.fake.stats)
+        dest = self.fake.spaces['dest']
+        stats.update({'tickets': len(dest.by_number),
+                'comments': sum(dest.comment_count.values()),
+                'documents': dest.document_count,
+                'associations': sum(len(v) for v in
+                    dest.association_list.values()) // 2})
+        return 200, stats
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, fake):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.fake = fake
+
+
+def serve(port=0, **options):
+    """Start a server in a background thread, return it"""
+    server = Server(('127.0.0.1', port), FakeAssembla(**options))
+    t = threading.Thread(target=server.serve_forever, name='fakeassembla')
+    t.daemon = True
+    t.start()
+    return server
+
+
+def option_parser():
+    parser = OptionParser()
+    parser.add_option('--port', type='int', default=0)
+    parser.add_option('--tickets', type='int', default=1000)
+    parser.add_option('--comments', type='int', default=5)
+    parser.add_option('--documents', type='int', default=1,
+            help='attachments per ticket')
+    parser.add_option('--document-size', type='int', default=16 * 1024)
+    parser.add_option('--latency', type='float', default=0.0,
+            help='mean seconds added to each request')
+    parser.add_option('--error-rate', type='float', default=0.0,
+            help='fraction of requests answered with a 503')
+    parser.add_option('--rate-limit', type='float', default=None,
+            help='requests per second before answering 429')
+    return parser
+
+
+if __name__ == '__main__':
+    options, args = option_parser().parse_args()
+    server = serve(options.port, tickets=options.tickets,
+            comments=options.comments, documents=options.documents,
+            document_size=options.document_size, latency=options.latency,
+            error_rate=options.error_rate, rate_limit=options.rate_limit)
+    # the benchmark reads the port from the first line
+    print server.server_address[1]
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,199 @@
+"""
+End to end migrate_tickets benchmark against the fake Assembla server.
+
+    python benchmarks/migration.py --sizes 1000,10000,100000 --concurrency 8 \\
+            --latency 0.02 --error-rate 0.01 --rate-limit 200
+
+For each size a fake server is started in its own process (so its memory
+is not counted) with a generated source space, then every ticket is
+migrated to the empty destination space. Reported: tickets/s, requests
+per ticket, peak RSS of the migrating process and, for each migration
+phase, its duration and p50/p99 API call latency.
+"""
+import os
+import sys
+import time
+import logging
+import resource
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import actions
+from assembla import API
+from assembla.HttpClient import HttpClient
+from assembla.metrics import REGISTRY
+from assembla.tracing import TRACER
+from assembla.websession import WebSession
+
+import fakeassembla
+
+PHASES = [
+    ('prepare', 'prepare_space_fields'),
+    ('numbers', 'check_ticket_numbers'),
+    ('tickets', 'copy_tickets'),
+    ('associations', 'copy_ticket_associations'),
+]
+
+
+class Recorder(object):
+    """Call latencies grouped by the migration phase running them"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase = 'other'
+        self.latencies = {}
+        self.durations = {}
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.setdefault(self.phase, []).append(seconds)
+
+    def timed(self, func):
+        def wrapper(*args, **kargs):
+            start = time.time()
+            try:
+                return func(*args, **kargs)
+            finally:
+                self.record(time.time() - start)
+        return wrapper
+
+    def phase_of(self, name, func):
+        def wrapper(*args, **kargs):
+            self.phase = name
+            start = time.time()
+            try:
+                return func(*args, **kargs)
+            finally:
+                self.durations[name] = time.time() - start
+                self.phase = 'other'
+        return wrapper
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class BenchSession(WebSession):
+    """WebSession logging in to the fake server without the HTML form"""
+
+    def login(self, seen=None):
+        with self.lock:
+            if seen is not None and self.logins != seen:
+                return
+            self.client.post(self.LOGIN_URL, data={
+                'user[login]': self.username,
+                'user[password]': self.password})
+            self.logins += 1
+
+
+def start_server(options, tickets):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            'fakeassembla.py')
+    args = [sys.executable, script, '--tickets', str(tickets),
+            '--comments', str(options.comments),
+            '--documents', str(options.documents),
+            '--document-size', str(options.document_size),
+            '--latency', str(options.latency),
+            '--error-rate', str(options.error_rate)]
+    if options.rate_limit:
+        args += ['--rate-limit', str(options.rate_limit)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE)
+    port = int(process.stdout.readline())
+    return process, '127.0.0.1:%d' % port
+
+
+def run(options, tickets):
+    process, host = start_server(options, tickets)
+    recorder = Recorder()
+    REGISTRY.reset()
+    if options.trace:
+        TRACER.start('%s.%d.json' % (options.trace, tickets))
+    patched = []
+    try:
+        for name, function in PHASES:
+            patched.append((actions, function, getattr(actions, function)))
+            setattr(actions, function,
+                    recorder.phase_of(name, getattr(actions, function)))
+        for cls, method in ((HttpClient, 'retry'), (WebSession, 'get')):
+            patched.append((cls, method, cls.__dict__[method]))
+            setattr(cls, method, recorder.timed(cls.__dict__[method]))
+
+        api = API('key', 'secret', host=host, retry_count=options.retries,
+                retry_delay=options.retry_delay,
+                rate_limit=options.client_rate_limit,
+                coalesce=options.coalesce)
+        api.initTokens('access', 'refresh')
+        spaces = dict((s.name, s) for s in api.get_spaces())
+        auth = None
+        if options.documents:
+            auth = BenchSession('bench', 'secret',
+                    retry_count=options.retries,
+                    retry_delay=options.retry_delay)
+            auth.LOGIN_URL = 'http://%s/do_login' % host
+
+        start = time.time()
+        actions.migrate_tickets(spaces['source'], spaces['dest'],
+                auth=auth, concurrency=options.concurrency)
+        elapsed = time.time() - start
+        stats = api.client.client.get('http://%s/_stats' % host).json()
+    finally:
+        for owner, name, original in reversed(patched):
+            setattr(owner, name, original)
+        process.terminate()
+        process.wait()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print '\n%d tickets, concurrency %d: %.1f s, %.1f tickets/s, ' \
+            '%.1f requests/ticket, peak RSS %.0f MB' % (tickets,
+            options.concurrency, elapsed, stats['tickets'] / elapsed,
+            stats['requests'] / float(max(stats['tickets'], 1)), rss)
+    print '  copied: %(tickets)d tickets, %(comments)d comments, ' \
+            '%(documents)d documents, %(associations)d associations' % stats
+    print '  server: %(requests)d requests, %(errors)d errors, ' \
+            '%(throttled)d throttled' % stats
+    print '  client: %d retries, %.1f s backoff base' % (sum([e['retries']
+            for e in REGISTRY.summary().values()]), options.retry_delay)
+    print '  %-14s %9s %8s %9s %9s' % ('phase', 'seconds', 'calls',
+            'p50 ms', 'p99 ms')
+    for name in [p[0] for p in PHASES] + ['other']:
+        latencies = recorder.latencies.get(name, [])
+        if not latencies and name not in recorder.durations:
+            continue
+        print '  %-14s %9.2f %8d %9.1f %9.1f' % (name,
+                recorder.durations.get(name, 0.0), len(latencies),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000)
+    if options.metrics:
+        REGISTRY.write_json('%s.%d.json' % (options.metrics, tickets))
+        REGISTRY.write_prometheus('%s.%d.prom' % (options.metrics, tickets))
+    TRACER.stop()
+
+
+if __name__ == '__main__':
+    parser = fakeassembla.option_parser()
+    parser.remove_option('--port')
+    parser.remove_option('--tickets')
+    parser.add_option('--sizes', default='1000',
+            help='comma separated ticket counts')
+    parser.add_option('--concurrency', type='int', default=8)
+    parser.add_option('--client-rate-limit', type='float', default=None)
+    parser.add_option('--retries', type='int', default=5)
+    parser.add_option('--retry-delay', type='float', default=0.1,
+            help='backoff base of retried requests, seconds')
+    parser.add_option('--coalesce', action='store_true', default=False)
+    parser.add_option('--metrics', default=None, metavar='PREFIX',
+            help='write per endpoint metrics to PREFIX.SIZE.json/.prom')
+    parser.add_option('--trace', default=None, metavar='PREFIX',
+            help='write a Chrome trace (for Perfetto) to PREFIX.SIZE.json')
+    parser.add_option('--debug', action='store_true', default=False,
+            help='show the migration log')
+    options, args = parser.parse_args()
+    if options.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    for size in options.sizes.split(','):
+        run(options, int(size))
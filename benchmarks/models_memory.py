@@ -0,0 +1,88 @@
+"""
+Memory used by parsed models, regular classes against the compact
+(__slots__ based) ones.
+
+    python benchmarks/models_memory.py [tickets] [comments per ticket]
+
+Each factory is measured in a forked child, from the resident set size
+before and after parsing the same synthetic tickets and comments.
+"""
+import os
+import sys
+import gc
+import time
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from assembla.models import ModelFactory
+from assembla.compact import CompactModelFactory
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def ticket_json(n):
+    return {
+        'id': 1000000 + n, 'number': n, 'summary': 'Ticket %d' % n,
+        'description': 'Description of ticket %d' % n, 'priority': 3,
+        'completed_date': None, 'component_id': None,
+        'created_on': '2013-03-01T10:00:00Z', 'permission_type': 1,
+        'importance': 0.0, 'is_story': False, 'milestone_id': 42,
+        'notification_list': '', 'space_id': 'abcdefgh', 'state': 1,
+        'status': 'New', 'story_importance': 0, 'updated_at': None,
+        'working_hours': 0.0, 'estimate': 0.0, 'total_estimate': 0.0,
+        'total_invested_hours': 0.0, 'total_working_hours': 0.0,
+        'assigned_to_id': None, 'reporter_id': 'user1',
+        'custom_fields': {'Type': 'Bug'}, 'hierarchy_type': 0,
+        'due_date': None,
+    }
+
+
+def comment_json(n, i):
+    return {
+        'id': n * 100 + i, 'comment': 'Comment %d on %d' % (i, n),
+        'user_id': 'user1', 'created_on': None, 'updated_at': None,
+        'ticket_id': 1000000 + n, 'ticket_changes': '--- []\n',
+        'rendered': None,
+    }
+
+
+def measure(factory, tickets, comments):
+    tickets_json = [ticket_json(n) for n in xrange(tickets)]
+    comments_json = [comment_json(n, i) for n in xrange(tickets)
+            for i in xrange(comments)]
+    gc.collect()
+    before = rss()
+    start = time.time()
+    parsed = factory.ticket.parse_list(None, tickets_json)
+    parsed += factory.ticketcomment.parse_list(None, comments_json)
+    elapsed = time.time() - start
+    gc.collect()
+    return rss() - before, elapsed, len(parsed)
+
+
+def run(name, factory, tickets, comments):
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+        os.write(w, repr(measure(factory, tickets, comments)))
+        os._exit(0)
+    os.close(w)
+    data = os.read(r, 1024)
+    os.waitpid(pid, 0)
+    used, elapsed, count = eval(data)
+    print '%-8s %8d objects %10.1f MB %8d bytes/object %7.2f s' % (
+            name, count, used / 1048576.0, used / count, elapsed)
+    return used
+
+
+if __name__ == '__main__':
+    tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    comments = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    regular = run('regular', ModelFactory, tickets, comments)
+    compact = run('compact', CompactModelFactory, tickets, comments)
+    print 'compact models use %.0f%% of the memory' % (100.0 * compact / regular)
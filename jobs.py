@@ -0,0 +1,91 @@
+import ConfigParser
+
+
+def read_ticket_file(filename):
+    """Ticket numbers listed one per line"""
+    numbers = []
+    with open(filename, 'r') as ticketfile:
+        for l in ticketfile:
+            if l.strip():
+                numbers.append(int(l))
+    return numbers
+
+
+def parse_tickets(spec):
+    """
+    Ticket selection: empty or 'all' for every ticket, '@path' for a
+    ticket list file, otherwise numbers and ranges, e.g. '1-50, 75'.
+    """
+    spec = (spec or '').strip()
+    if spec in ('', 'all'):
+        return None
+    if spec.startswith('@'):
+        return read_ticket_file(spec[1:].strip())
+    numbers = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = [int(n) for n in part.split('-', 1)]
+            numbers.extend(range(start, end + 1))
+        else:
+            numbers.append(int(part))
+    return numbers
+
+
+class Job(object):
+    """One space pair to migrate and how"""
+
+    def __init__(self, name, source, dest, tickets=None, renumber=False,
+            concurrency=1, documents=True, delete=False, map_file=None):
+        self.name = name
+        self.source = source
+        self.dest = dest
+        # ticket numbers, None for all of the source space
+        self.tickets = tickets
+        self.renumber = renumber
+        self.concurrency = concurrency
+        self.documents = documents
+        # delete source tickets once copied, only used if asked for
+        self.delete = delete
+        self.map_file = map_file or 'ticket_map.%s.csv' % name
+
+    def __repr__(self):
+        return '<Job %s: %s -> %s>' % (self.name, self.source, self.dest)
+
+
+def load_jobs(filename):
+    """
+    Jobs from an INI file, one section per job, in file order. Options
+    in [DEFAULT] apply to every job:
+
+        [DEFAULT]
+        concurrency = 8
+
+        [web]
+        source = Old Web
+        dest = New Web
+        tickets = 1-200, 305
+        renumber = yes
+        map = web_map.csv
+    """
+    config = ConfigParser.RawConfigParser({'tickets': '', 'renumber': 'no',
+            'concurrency': '1', 'documents': 'yes', 'delete': 'no',
+            'map': ''})
+    if not config.read(filename):
+        raise IOError('Could not read job file %s' % filename)
+    jobs = []
+    for name in config.sections():
+        try:
+            jobs.append(Job(name, config.get(name, 'source'),
+                    config.get(name, 'dest'),
+                    tickets=parse_tickets(config.get(name, 'tickets')),
+                    renumber=config.getboolean(name, 'renumber'),
+                    concurrency=config.getint(name, 'concurrency'),
+                    documents=config.getboolean(name, 'documents'),
+                    delete=config.getboolean(name, 'delete'),
+                    map_file=config.get(name, 'map') or None))
+        except (ConfigParser.Error, ValueError), e:
+            raise ValueError('Job [%s] in %s: %s' % (name, filename, e))
+    return jobs
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+
+from assembla.utils import import_simplejson
+
+json = import_simplejson()
+
+
+class JournalError(Exception):
+    """The journal holds progress of a run with other options"""
+
+
+class Journal(object):
+    """
+    Durable record of finished migration units, kept in a SQLite file.
+
+    Every unit is identified by a kind ('ticket', 'comment', ...) and a key,
+    and may carry a JSON value (e.g. the id of the copied object). A job
+    name keeps units of different space pairs apart in the same file.
+    """
+
+    def __init__(self, filename, job=''):
+        self.filename = filename
+        self.job = job
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS units ('
+                'job TEXT, kind TEXT, key TEXT, value TEXT, '
+                'PRIMARY KEY (job, kind, key))')
+        self.db.commit()
+
+    @classmethod
+    def for_spaces(cls, filename, space1, space2, name=None):
+        # named jobs on the same spaces (e.g. other tickets) are kept apart
+        job = '%s:%s' % (space1.id, space2.id)
+        if name:
+            job = '%s:%s' % (job, name)
+        return cls(filename, job)
+
+    def check_options(self, **options):
+        """
+        Record the options (ticket selection, renumbering) of the run on
+        first use. Progress made with other options is never resumed,
+        since its number map would not match: JournalError is raised and
+        the journal has to be reset (or not used) instead.
+        """
+        # compare as stored, e.g. tuples come back as lists
+        options = json.loads(json.dumps(options))
+        recorded = self.get('run', 'options')
+        if recorded is None:
+            if self.units():
+                raise JournalError('%s has progress made with unknown '
+                        'options' % self.filename)
+            self.record('run', 'options', options)
+        elif recorded != options:
+            changed = sorted(k for k in set(recorded) | set(options)
+                    if recorded.get(k) != options.get(k))
+            raise JournalError('%s has progress made with other options '
+                    '(%s)' % (self.filename, ', '.join(changed)))
+
+    def units(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM units WHERE job = ?',
+                    (self.job,)).fetchone()[0]
+
+    def reset(self):
+        """Forget the progress of this job, the next run starts over"""
+        with self.lock:
+            self.db.execute('DELETE FROM units WHERE job = ?', (self.job,))
+            self.db.commit()
+
+    def get(self, kind, key, default=None):
+        """Get the value recorded for a unit, default if not finished"""
+        with self.lock:
+            row = self.db.execute('SELECT value FROM units WHERE job = ? '
+                    'AND kind = ? AND key = ?', (self.job, kind, str(key))
+                    ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def done(self, kind, key):
+        return self.get(kind, key) is not None
+
+    def record(self, kind, key, value=True):
+        """Mark a unit as finished, committed right away"""
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)',
+                    (self.job, kind, str(key), json.dumps(value)))
+            self.db.commit()
+
+    def items(self, kind):
+        with self.lock:
+            rows = self.db.execute('SELECT key, value FROM units WHERE '
+                    'job = ? AND kind = ?', (self.job, kind)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def get_map(self, name):
+        """Get a recorded mapping, JSON objects only allow string keys"""
+        pairs = self.get('map', name)
+        if pairs is None:
+            return None
+        return dict((k, v) for k, v in pairs)
+
+    def record_map(self, name, mapping):
+        self.record('map', name, mapping.items())
+
+    def close(self):
+        self.db.close()
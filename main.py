@@ -2,12 +2,20 @@ import sys
 import os
 import csv
 import logging
+import optparse
 import ConfigParser
 
 from assembla.api import API
 from assembla.error import AssemblaError
+from assembla.websession import WebSession
+from assembla.blobstore import BlobStore
+from assembla.cache import DiskCache
+from assembla.metrics import REGISTRY
+from assembla.tracing import TRACER
 
 from actions import migrate_tickets
+from journal import Journal, JournalError
+from jobs import Job, load_jobs, parse_tickets, read_ticket_file
 
 logger = logging.getLogger('ATMT')
 logger.setLevel(logging.DEBUG)
@@ -22,126 +30,354 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
+filename = os.path.join(os.environ['HOME'], '.atmt')
+cache_filename = os.path.join(os.environ['HOME'], '.atmt_cache')
+
+def unset(value):
+    return value in ["None", None, ""]
+
 def init_client(client):
     print ("Follow this url: {0}".format(client.getAuthorizeUrl()))
     pin = raw_input("Enter your pin: ")
     client.initClient(pin)
     return client
 
-filename = os.path.join(os.environ['HOME'], '.atmt')
-
-config = ConfigParser.RawConfigParser({
-            'client_id':None,
-            'client_secret':None,
-            'bearer_token':None,
-            'refresh_token':None
-})
+def load_config():
+    config = ConfigParser.RawConfigParser({
+                'client_id':None,
+                'client_secret':None,
+                'bearer_token':None,
+                'refresh_token':None,
+                'username':None,
+                'password':None
+    })
 
-config.add_section('ApplicationTokens')
-config.add_section('ClientTokens')
+    config.add_section('ApplicationTokens')
+    config.add_section('ClientTokens')
+    config.add_section('WebAccount')
 
-config.read(filename)
+    config.read(filename)
+    return config
 
-client_id = config.get('ApplicationTokens', 'client_id')
-if client_id in ["None", None]:
-    print "Create a client here: https://www.assembla.com/user/edit/manage_clients"
-    client_id = raw_input("Please type enter your Client ID: ")
-client_secret = config.get('ApplicationTokens', 'client_secret')
-if client_secret in ["None", None]:
-    client_secret = raw_input("Please type enter your Client Secret: ")
+def save_config(config, api):
+    with open(filename, 'wb') as configfile:
+        config.set('ApplicationTokens', 'client_id', api.client.consumer_key)
+        config.set('ApplicationTokens', 'client_secret', api.client.consumer_secret)
+        config.set('ClientTokens', 'bearer_token', api.client.access_token)
+        config.set('ClientTokens', 'refresh_token', api.client.refresh_token)
+        config.write(configfile)
+    os.chmod(filename, 0600)
 
-print "We require an Assembla account info to download documents"
-username = raw_input("Please enter your Assembla.com username: ")
-password = raw_input("and password: ")
-auth = (username, password)
+def authenticate(api, config, pin=None, interactive=True):
+    refresh_token = config.get('ClientTokens', 'refresh_token')
+    bearer_token = config.get('ClientTokens', 'bearer_token')
+    if not unset(bearer_token):
+        try:
+            # an expired bearer token is refreshed by the first call
+            api.initTokens(bearer_token, refresh_token)
+            api.me()
+            return api
+        except AssemblaError:
+            logger.debug('[Application] Stored tokens were rejected')
+    if pin:
+        api.initClient(pin)
+    elif interactive:
+        init_client(api)
+    else:
+        raise AssemblaError('No valid tokens in %s, run main.py once '
+                'interactively or pass --pin' % filename)
+    return api
 
-space1 = raw_input("Please enter the name of the space to copy tickets from: ")
-space2 = raw_input("Please enter the name of the space to copy tickets to: ")
+def web_session(username, password):
+    # logged in once, cookies and downloaded documents are reused by later runs
+    return WebSession(username, password,
+            cookie_file=os.path.join(os.environ['HOME'], '.atmt_cookies'),
+            blobs=BlobStore(os.path.join(os.environ['HOME'], '.atmt_blobs')))
 
-tickets = raw_input("Please enter full path to ticket list: ")
+def response_cache(cache_file):
+    # kept between runs, every entry is revalidated (ETag) before use so a
+    # re-run only downloads what changed
+    if cache_file:
+        return DiskCache(cache_file, timeout=0)
 
-api = API(client_id, client_secret)
-
-refresh_token = config.get('ClientTokens', 'refresh_token')
-bearer_token = config.get('ClientTokens', 'bearer_token')
-if bearer_token != "None":
-    try:
-        api.initTokens(bearer_token, refresh_token)
-        api.me()
-    except AssemblaError:
-        api = init_client(api)
-        bearer_token = api.client.access_token
-        refresh_token = api.client.refresh_token
-else:
-    api = init_client(api)
-    bearer_token = api.client.service.access_token
-
-with open(filename, 'wb') as configfile:
-    config.set('ApplicationTokens', 'client_id', client_id)
-    config.set('ApplicationTokens', 'client_secret', client_secret)
-    config.set('ClientTokens', 'bearer_token', bearer_token)
-    config.set('ClientTokens', 'refresh_token', refresh_token)
-    config.write(configfile)
-
-ticketlist = []
-with open(tickets, 'r') as ticketfile:
-    lines = ticketfile.readlines()
-    for l in lines:
-        if l:
-            ticketlist.append(int(l))
-
-renumber=False
-assign_new_numbers = raw_input('Re-number copied tickets (if destination is not empty)? [y/N] ')
-if assign_new_numbers == "y":
-    renumber=True
-
-print "************************************************************"
-print "*              About to start ticket migration             *"
-print "*                                                          *"
-print "*    if you'd like to delete instead, skip this step.      *"
-print "*                                                          *"
-print "*                type 'copy' to copy                       *"
-print "************************************************************"
-copy = raw_input("Okay to start copy process? [copy/N] ")
-
-spaces=api.get_spaces()
-sp1 = sp2 = None
-for space in spaces:
-    if space.name == space1:
-        sp1 = space
-    if space.name == space2:
-        sp2 = space
-if not sp1 or not sp2:
-    logger.debug('[Application] Could not find spaces, exiting.')
-    sys.exit()
-
-if copy == 'copy':
-    logger.debug('[Application] Starting Copy Process')
-    nmap = migrate_tickets(sp1, sp2, ticket_numbers=ticketlist, auth=auth,
-            renumber=renumber)
-    with open('ticket_map.csv', 'wb') as csvfile:
+def write_ticket_map(mapfile, nmap):
+    with open(mapfile, 'wb') as csvfile:
         writer = csv.writer(csvfile, delimiter=',')
         for n in nmap:
             writer.writerow([n, nmap[n]])
+
+def write_reports():
+    # per endpoint call counts and latencies of this run
+    REGISTRY.write_json('ATMT.metrics.json')
+    REGISTRY.write_prometheus('ATMT.prom')
+    TRACER.stop()
+
+def start_trace(trace):
+    # timeline of phases, tickets and API calls to open in Perfetto
+    if trace:
+        TRACER.start(trace)
+        logger.debug('[Application] Tracing to %s', trace)
+
+def interactive(trace=None, journal_file='ATMT.journal',
+        reset_journal=False, cache_file=cache_filename):
+    config = load_config()
+
+    client_id = config.get('ApplicationTokens', 'client_id')
+    if unset(client_id):
+        print "Create a client here: https://www.assembla.com/user/edit/manage_clients"
+        client_id = raw_input("Please type enter your Client ID: ")
+    client_secret = config.get('ApplicationTokens', 'client_secret')
+    if unset(client_secret):
+        client_secret = raw_input("Please type enter your Client Secret: ")
+
+    print "We require an Assembla account info to download documents"
+    username = raw_input("Please enter your Assembla.com username: ")
+    password = raw_input("and password: ")
+    auth = web_session(username, password)
+
+    space1 = raw_input("Please enter the name of the space to copy tickets from: ")
+    space2 = raw_input("Please enter the name of the space to copy tickets to: ")
+
+    tickets = raw_input("Please enter full path to ticket list: ")
+
+    api = authenticate(API(client_id, client_secret,
+            cache=response_cache(cache_file)), config)
+    save_config(config, api)
+
+    ticketlist = read_ticket_file(tickets)
+
+    renumber=False
+    assign_new_numbers = raw_input('Re-number copied tickets (if destination is not empty)? [y/N] ')
+    if assign_new_numbers == "y":
+        renumber=True
+
     print "************************************************************"
-    print "* For your convenience a file mapping new ticket numbers   *"
-    print "* has been placed in the current directory called:         *"
+    print "*              About to start ticket migration             *"
+    print "*                                                          *"
+    print "*    if you'd like to delete instead, skip this step.      *"
     print "*                                                          *"
-    print "*                ticket_map.csv                            *"
+    print "*                type 'copy' to copy                       *"
     print "************************************************************"
-    logger.debug('[Application] Finished Copy Process')
-
-print "************************************************************"
-print "*   WARNING!! It is not possible to recover from deletion  *"
-print "*             Re-run tool after checking migration         *"
-print "*             type 'delete' to delete tickets              *"
-print "************************************************************"
-delete = raw_input("Okay to delete tickets RIGHT NOW? [delete/N] ")
-
-if delete == 'delete':
-    logger.debug('[Application] Starting Ticket Deletion')
-    for t in ticketlist:
-        t = sp1.get_ticket(number=t)
-        t.destroy()
-        logger.debug('[Application] Deleted ticket %s from %s', t.number, sp1.name)
-    logger.debug('[Application] Finished Ticket Deletion') 
+    copy = raw_input("Okay to start copy process? [copy/N] ")
+
+    spaces=api.get_spaces()
+    sp1 = sp2 = None
+    for space in spaces:
+        if space.name == space1:
+            sp1 = space
+        if space.name == space2:
+            sp2 = space
+    if not sp1 or not sp2:
+        logger.debug('[Application] Could not find spaces, exiting.')
+        sys.exit()
+
+    if copy == 'copy':
+        logger.debug('[Application] Starting Copy Process')
+        # progress is kept here, re-running after a failure resumes the copy
+        journal = None
+        if journal_file:
+            journal = Journal.for_spaces(journal_file, sp1, sp2)
+            if reset_journal:
+                journal.reset()
+        start_trace(trace)
+        try:
+            nmap = migrate_tickets(sp1, sp2, ticket_numbers=ticketlist,
+                    auth=auth, renumber=renumber, journal=journal)
+        except JournalError, e:
+            print e
+            again = raw_input('Discard that progress and start over? [y/N] ')
+            if again != 'y':
+                sys.exit(1)
+            journal.reset()
+            nmap = migrate_tickets(sp1, sp2, ticket_numbers=ticketlist,
+                    auth=auth, renumber=renumber, journal=journal)
+        write_ticket_map('ticket_map.csv', nmap)
+        write_reports()
+        print "************************************************************"
+        print "* For your convenience a file mapping new ticket numbers   *"
+        print "* has been placed in the current directory called:         *"
+        print "*                                                          *"
+        print "*                ticket_map.csv                            *"
+        print "************************************************************"
+        logger.debug('[Application] Finished Copy Process')
+
+    print "************************************************************"
+    print "*   WARNING!! It is not possible to recover from deletion  *"
+    print "*             Re-run tool after checking migration         *"
+    print "*             type 'delete' to delete tickets              *"
+    print "************************************************************"
+    delete = raw_input("Okay to delete tickets RIGHT NOW? [delete/N] ")
+
+    if delete == 'delete':
+        logger.debug('[Application] Starting Ticket Deletion')
+        for t in ticketlist:
+            t = sp1.get_ticket(number=t)
+            t.destroy()
+            logger.debug('[Application] Deleted ticket %s from %s', t.number, sp1.name)
+        logger.debug('[Application] Finished Ticket Deletion')
+
+def delete_copied_tickets(space, nmap, journal):
+    # only tickets the journal has as completely copied, never failed ones
+    logger.debug('[Batch] Starting Ticket Deletion from %s', space.name)
+    for n in sorted(nmap):
+        if not journal.done('ticket_done', n):
+            logger.debug('[Batch] Keeping ticket %s, it was not copied', n)
+            continue
+        space.get_ticket(number=n).destroy()
+        logger.debug('[Batch] Deleted ticket %s from %s', n, space.name)
+    logger.debug('[Batch] Finished Ticket Deletion')
+
+def run_job(spaces, job, auth, journal_file, reset_journal=False):
+    sp1 = spaces.get(job.source)
+    sp2 = spaces.get(job.dest)
+    if not sp1 or not sp2:
+        logger.debug('[Batch] Job %s: could not find spaces %s and %s, '
+                'skipping', job.name, job.source, job.dest)
+        return False
+    logger.debug('[Batch] Starting job %s: %s -> %s', job.name, sp1.name,
+            sp2.name)
+    journal = None
+    if journal_file:
+        journal = Journal.for_spaces(journal_file, sp1, sp2, job.name)
+        if reset_journal:
+            journal.reset()
+    try:
+        nmap = migrate_tickets(sp1, sp2, ticket_numbers=job.tickets,
+                auth=auth if job.documents else None, renumber=job.renumber,
+                concurrency=job.concurrency, journal=journal)
+    except AssemblaError, e:
+        logger.debug('[Batch] Job %s failed: %s', job.name, e)
+        return False
+    except JournalError, e:
+        logger.debug('[Batch] Job %s: %s, pass --reset-journal to start '
+                'over', job.name, e)
+        return False
+    if nmap is None:
+        logger.debug('[Batch] Job %s failed the ticket number check', job.name)
+        return False
+    write_ticket_map(job.map_file, nmap)
+    logger.debug('[Batch] Job %s: ticket map written to %s', job.name,
+            job.map_file)
+    if job.delete:
+        try:
+            delete_copied_tickets(sp1, nmap, journal)
+        except AssemblaError, e:
+            logger.debug('[Batch] Job %s: deletion failed: %s', job.name, e)
+            return False
+    return True
+
+def batch(parser, options):
+    """Run every job without prompting, return the exit status"""
+    jobs = []
+    try:
+        if options.jobs:
+            jobs.extend(load_jobs(options.jobs))
+        if options.source or options.dest:
+            if not (options.source and options.dest):
+                parser.error('--from and --to go together')
+            jobs.append(Job('cli', options.source, options.dest,
+                    tickets=parse_tickets(options.tickets),
+                    renumber=options.renumber,
+                    concurrency=options.concurrency,
+                    documents=options.documents, delete=options.delete,
+                    map_file=options.map))
+    except (IOError, ValueError), e:
+        parser.error(str(e))
+    if not jobs:
+        parser.error('nothing to do, give --jobs or --from and --to')
+    if not options.journal and [job for job in jobs if job.delete]:
+        parser.error('deleting copied tickets needs the journal')
+
+    config = load_config()
+    client_id = config.get('ApplicationTokens', 'client_id')
+    client_secret = config.get('ApplicationTokens', 'client_secret')
+    if unset(client_id) or unset(client_secret):
+        parser.error('no client id/secret in %s, run main.py once '
+                'interactively' % filename)
+
+    auth = None
+    if [job for job in jobs if job.documents]:
+        username = os.environ.get('ATMT_USERNAME') or \
+                config.get('WebAccount', 'username')
+        password = os.environ.get('ATMT_PASSWORD') or \
+                config.get('WebAccount', 'password')
+        if unset(username) or unset(password):
+            parser.error('documents need an Assembla.com login: set '
+                    'ATMT_USERNAME/ATMT_PASSWORD or [WebAccount] in %s, or '
+                    'pass --no-documents' % filename)
+        auth = web_session(username, password)
+
+    # one authenticated client and connection pool for every job
+    api = API(client_id, client_secret, retry_count=options.retries,
+            retry_delay=3, cache=response_cache(options.cache))
+    try:
+        authenticate(api, config, options.pin, interactive=False)
+    except AssemblaError, e:
+        logger.debug('[Batch] %s', e)
+        return 1
+    save_config(config, api)
+
+    start_trace(options.trace)
+    spaces = dict((space.name, space) for space in api.get_spaces())
+    failed = []
+    for job in jobs:
+        if not run_job(spaces, job, auth, options.journal,
+                options.reset_journal):
+            failed.append(job.name)
+    # tokens may have been refreshed during the run
+    save_config(config, api)
+    write_reports()
+    logger.debug('[Batch] %s of %s jobs finished%s', len(jobs) - len(failed),
+            len(jobs), failed and ', failed: %s' % ', '.join(failed) or '')
+    return 1 if failed else 0
+
+def option_parser():
+    parser = optparse.OptionParser(usage='%prog [options]',
+            description='Without options tickets are copied interactively. '
+            'With --jobs or --from/--to every job runs without prompts, '
+            'credentials are read from ~/.atmt.')
+    parser.add_option('--jobs', metavar='FILE',
+            help='INI file with one [section] per job, see jobs.py')
+    parser.add_option('--from', dest='source', metavar='SPACE',
+            help='name of the space to copy tickets from')
+    parser.add_option('--to', dest='dest', metavar='SPACE',
+            help='name of the space to copy tickets to')
+    parser.add_option('--tickets', default='', metavar='SPEC',
+            help="'1-50,75', '@ticket_list_file', default all tickets")
+    parser.add_option('--renumber', action='store_true', default=False,
+            help='re-number copied tickets')
+    parser.add_option('--concurrency', type='int', default=1,
+            help='tickets copied at once')
+    parser.add_option('--no-documents', dest='documents',
+            action='store_false', default=True,
+            help='do not copy attached documents')
+    parser.add_option('--delete', action='store_true', default=False,
+            help='delete source tickets once they are copied')
+    parser.add_option('--map', metavar='FILE',
+            help='ticket number map, default ticket_map.cli.csv')
+    parser.add_option('--journal', default='ATMT.journal', metavar='FILE',
+            help='progress of every job, used to resume')
+    parser.add_option('--no-journal', dest='journal', action='store_const',
+            const=None, help='do not record or resume progress')
+    parser.add_option('--reset-journal', action='store_true', default=False,
+            help='forget recorded progress, start every job over')
+    parser.add_option('--cache', default=cache_filename, metavar='FILE',
+            help='API responses kept between runs, revalidated before use')
+    parser.add_option('--no-cache', dest='cache', action='store_const',
+            const=None, help='do not keep API responses')
+    parser.add_option('--pin', help='authorization pin if tokens are missing')
+    parser.add_option('--retries', type='int', default=3,
+            help='retries of failed API requests')
+    parser.add_option('--trace', metavar='FILE',
+            default=os.environ.get('ATMT_TRACE'),
+            help='write a Chrome trace of the migration (for Perfetto), '
+            'also set by ATMT_TRACE')
+    return parser
+
+if __name__ == '__main__':
+    parser = option_parser()
+    options, args = parser.parse_args()
+    if options.jobs or options.source or options.dest:
+        sys.exit(batch(parser, options))
+    interactive(options.trace, options.journal, options.reset_journal,
+            options.cache)
@@ -0,0 +1,128 @@
+import unittest
+
+import actions
+from assembla.error import AssemblaError
+from assembla.models import TicketAssociation
+from journal import Journal
+
+
+def association(ticket1_id, ticket2_id, relationship, id=None):
+    a = TicketAssociation()
+    a.id = id
+    a.ticket1_id, a.ticket2_id, a.relationship = \
+            ticket1_id, ticket2_id, relationship
+    return a
+
+
+class Space(object):
+    """Associations by ticket number, ticket ids are 10 * number"""
+
+    _api = None
+
+    def __init__(self, name, associations=(), fail=()):
+        self.name = name
+        self.associations = list(associations)
+        self.created = []
+        self.listed = []
+        self.fail = fail
+
+    def get_associations(self, number):
+        self.listed.append(number)
+        return [a for a in self.associations
+                if number * 10 in (a.ticket1_id, a.ticket2_id)]
+
+    def create_association(self, number, a):
+        if number in self.fail:
+            raise AssemblaError('failed')
+        self.created.append((number, a.ticket1_id, a.ticket2_id,
+                a.relationship))
+        self.associations.append(a)
+
+
+class Source(object):
+
+    def __init__(self, ids):
+        self.ids = ids
+
+
+class EdgeTest(unittest.TestCase):
+
+    def test_lowest_id_comes_first(self):
+        self.assertEqual(actions.association_edge(association(20, 10, 0)),
+                (10, 20, 1))
+        self.assertEqual(actions.association_edge(association(10, 20, 0)),
+                (10, 20, 0))
+
+    def test_symmetric_relationship_is_kept(self):
+        self.assertEqual(actions.association_edge(association(20, 10, 2)),
+                (10, 20, 2))
+
+    def test_ids_are_mapped(self):
+        self.assertEqual(actions.association_edge(association(10, 20, 7),
+                {10: 300, 20: 100}), (100, 300, 8))
+
+
+class CopyAssociationsTest(unittest.TestCase):
+
+    # source tickets 1, 2, 3 are copied as 4, 5, 6 (ids 10 * number)
+    id_map = {10: 40, 20: 50, 30: 60}
+    id_number_map = {40: 4, 50: 5, 60: 6}
+    number_map = {1: 4, 2: 5, 3: 6}
+
+    def copy(self, space1, space2, journal=None, source=None):
+        actions.copy_ticket_associations(space1, space2, self.id_map,
+                self.number_map, self.id_number_map, journal,
+                source=source)
+
+    def test_association_listed_from_both_ends_is_created_once(self):
+        space1 = Space('a', [association(10, 20, 0, 'a1')])
+        space2 = Space('b')
+        self.copy(space1, space2)
+        self.assertEqual(space2.created, [(4, 40, 50, 0)])
+
+    def test_existing_associations_are_skipped(self):
+        space1 = Space('a', [association(10, 20, 0), association(20, 30, 2)])
+        # the same association, recorded from the other ticket
+        space2 = Space('b', [association(50, 40, 1)])
+        self.copy(space1, space2)
+        self.assertEqual(space2.created, [(5, 50, 60, 2)])
+
+    def test_associations_with_tickets_not_copied_are_skipped(self):
+        space1 = Space('a', [association(10, 90, 0)])
+        space2 = Space('b')
+        self.copy(space1, space2)
+        self.assertEqual(space2.created, [])
+
+    def test_failed_tickets_are_not_listed(self):
+        space1 = Space('a', [association(10, 20, 0)])
+        space2 = Space('b')
+        # ticket 3 (id 30) failed to copy
+        id_map = dict(self.id_map)
+        del id_map[30]
+        actions.copy_ticket_associations(space1, space2, id_map,
+                self.number_map, self.id_number_map,
+                source=Source({1: 10, 2: 20, 3: 30}))
+        self.assertEqual(space1.listed, [1, 2])
+
+    def test_journal_skips_finished_work(self):
+        journal = Journal(':memory:', 'job')
+        space1 = Space('a', [association(10, 20, 0), association(20, 30, 2)])
+        space2 = Space('b', fail=(5,))
+        self.copy(space1, space2, journal)
+        self.assertEqual(space2.created, [(4, 40, 50, 0)])
+        self.assertTrue(journal.done('association', '40:50:0'))
+        # a failed association keeps the tickets from being marked done
+        self.assertFalse(journal.done('associations', 1))
+
+        space2.fail = ()
+        space2.associations = []
+        self.copy(space1, space2, journal)
+        self.assertEqual(space2.created, [(4, 40, 50, 0), (5, 50, 60, 2)])
+        self.assertTrue(journal.done('associations', 1))
+        space1.listed = []
+        self.copy(space1, space2, journal)
+        self.assertEqual(space1.listed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
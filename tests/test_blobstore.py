@@ -0,0 +1,139 @@
+import shutil
+import tempfile
+import unittest
+
+from assembla import blobstore
+from assembla.blobstore import BlobStore
+
+
+class Clock(object):
+    """Every call is one second later, so use times never tie"""
+
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class Document(object):
+
+    def __init__(self, id, url=None, version=None):
+        self.id = id
+        self.url = url or 'http://example.com/%s' % id
+        self.version = version
+
+
+class Response(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, size):
+        for i in range(0, len(self.content), 10):
+            yield self.content[i:i + 10]
+
+
+class Session(object):
+    """Serves 'content of <url>', counting downloads"""
+
+    def __init__(self):
+        self.downloads = 0
+
+    def get(self, url, stream=False):
+        self.downloads += 1
+        return Response('content of %s' % url)
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.time, blobstore.time = blobstore.time, Clock()
+
+    def tearDown(self):
+        blobstore.time = self.time
+        shutil.rmtree(self.directory)
+
+    def store(self, max_size=100):
+        return BlobStore(self.directory, max_size)
+
+    def test_store_and_lookup(self):
+        store = self.store()
+        path = store.store('d1', ['ab', 'cd'])
+        self.assertEqual(open(path, 'rb').read(), 'abcd')
+        self.assertEqual(store.lookup('d1'), path)
+        self.assertEqual(store.lookup('d2'), None)
+
+    def test_same_content_is_stored_once(self):
+        store = self.store()
+        self.assertEqual(store.store('d1', ['x' * 10]),
+                store.store('d2', ['x' * 10]))
+        self.assertEqual(store.size, 10)
+
+    def test_least_recently_used_is_evicted(self):
+        store = self.store(max_size=30)
+        for i in range(3):
+            store.store('d%d' % i, [str(i) * 10])
+        store.lookup('d0')
+        store.store('d3', ['3' * 10])
+        self.assertEqual(store.lookup('d1'), None)
+        for i in (0, 2, 3):
+            self.assertNotEqual(store.lookup('d%d' % i), None)
+        self.assertEqual(store.size, 30)
+
+    def test_new_blob_is_kept_when_larger_than_the_store(self):
+        store = self.store(max_size=30)
+        store.store('small', ['s' * 10])
+        path = store.store('big', ['b' * 50])
+        self.assertEqual(store.lookup('big'), path)
+        self.assertEqual(store.lookup('small'), None)
+
+    def test_size_survives_reopening(self):
+        store = self.store()
+        store.store('d1', ['x' * 10])
+        store.db.close()
+        self.assertEqual(self.store().size, 10)
+
+    def test_open_downloads_once(self):
+        store = self.store()
+        session = Session()
+        for i in range(3):
+            f = store.open(Document('d1'), session)
+            self.assertEqual(f.read(), 'content of http://example.com/d1')
+            f.close()
+        self.assertEqual(session.downloads, 1)
+        self.assertEqual((store.hits, store.misses), (2, 1))
+
+    def test_new_version_is_downloaded_again(self):
+        store = self.store()
+        session = Session()
+        store.open(Document('d1', 'http://example.com/v1', 1), session)
+        self.assertEqual(store.open(Document('d1', 'http://example.com/v2',
+                2), session).read(), 'content of http://example.com/v2')
+        self.assertEqual(session.downloads, 2)
+        store.open(Document('d1', 'http://example.com/v1', 1), session)
+        self.assertEqual(session.downloads, 2)
+
+    def test_evicted_document_is_downloaded_again(self):
+        store = self.store(max_size=40)
+        session = Session()
+        store.open(Document('d1'), session).close()
+        store.open(Document('d2'), session).close()
+        self.assertEqual(store.open(Document('d1'), session).read(),
+                'content of http://example.com/d1')
+        self.assertEqual(session.downloads, 3)
+
+    def test_open_blob_stays_readable_after_eviction(self):
+        store = self.store(max_size=40)
+        session = Session()
+        f = store.open(Document('d1'), session)
+        store.open(Document('d2'), session).close()
+        self.assertEqual(store.lookup('d1'), None)
+        self.assertEqual(f.read(), 'content of http://example.com/d1')
+        f.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
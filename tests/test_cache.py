@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from assembla.api import API
+from assembla.cache import MemoryCache
+from assembla.metrics import Metrics
+
+
+class Response(object):
+
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+def milestone(title):
+    return json.dumps({'id': 'm1', 'title': title})
+
+
+class FakeServer(object):
+    """Answers GETs with the given responses, records the headers sent"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def GET(self, url, headers=None, **kargs):
+        self.sent.append(headers)
+        return self.responses.pop(0)
+
+
+class RevalidationTest(unittest.TestCase):
+
+    def api(self, server, timeout=0):
+        api = API('key', 'secret', cache=MemoryCache(timeout=timeout),
+                metrics=Metrics())
+        api.initTokens('access', 'refresh')
+        api.client.GET = server.GET
+        return api
+
+    def get(self, api):
+        return api.get_milestone(space='s', milestone='m1')
+
+    def test_fresh_entry_is_served_without_request(self):
+        server = FakeServer(Response(200, milestone('v1'), {'etag': '"1"'}))
+        api = self.api(server, timeout=60)
+        self.assertEqual(self.get(api).title, 'v1')
+        self.assertEqual(self.get(api).title, 'v1')
+        self.assertEqual(len(server.sent), 1)
+
+    def test_not_modified_uses_cached_content(self):
+        server = FakeServer(Response(200, milestone('v1'), {'etag': '"1"'}),
+                Response(304))
+        api = self.api(server)
+        self.get(api)
+        self.assertEqual(self.get(api).title, 'v1')
+        self.assertEqual(server.sent[1]['If-None-Match'], '"1"')
+
+    def test_changed_resource_replaces_entry(self):
+        server = FakeServer(Response(200, milestone('v1'), {'etag': '"1"'}),
+                Response(200, milestone('v2'), {'etag': '"2"'}),
+                Response(304))
+        api = self.api(server)
+        self.get(api)
+        self.assertEqual(self.get(api).title, 'v2')
+        self.assertEqual(self.get(api).title, 'v2')
+        self.assertEqual(server.sent[2]['If-None-Match'], '"2"')
+
+    def test_last_modified_is_sent_back(self):
+        date = 'Fri, 01 Mar 2013 10:00:00 GMT'
+        server = FakeServer(Response(200, milestone('v1'),
+                {'last-modified': date}), Response(304))
+        api = self.api(server)
+        self.get(api)
+        self.get(api)
+        self.assertEqual(server.sent[1]['If-Modified-Since'], date)
+        self.assertNotIn('If-None-Match', server.sent[1])
+
+    def test_entry_without_validators_is_fetched_again(self):
+        server = FakeServer(Response(200, milestone('v1')),
+                Response(200, milestone('v2')))
+        api = self.api(server)
+        self.get(api)
+        self.assertEqual(self.get(api).title, 'v2')
+        self.assertNotIn('If-None-Match', server.sent[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from assembla.cursor import Cursor
+
+
+def listing(items, cap):
+    """Page mode endpoint over `items`, serving at most `cap` per page"""
+
+    def method(page, per_page):
+        method.requested.append(page)
+        size = min(per_page, cap)
+        return items[(page - 1) * size:page * size]
+    method.pagination_mode = 'page'
+    method.max_per_page = 10
+    method.requested = []
+    return method
+
+
+class PageIteratorTest(unittest.TestCase):
+
+    def test_pages_capped_below_the_page_size(self):
+        method = listing(range(23), cap=4)
+        self.assertEqual(list(Cursor(method).items()), range(23))
+        self.assertEqual(method.requested, range(1, 8))
+
+    def test_short_page_ends_once_the_size_is_honoured(self):
+        method = listing(range(23), cap=10)
+        self.assertEqual(list(Cursor(method).items()), range(23))
+        self.assertEqual(method.requested, [1, 2, 3])
+        # later listings of the endpoint trust a short first page
+        method.requested = []
+        self.assertEqual(list(Cursor(method).items(limit=5)), range(5))
+        method.requested = []
+        method.max_per_page = 50
+        list(Cursor(method).items())
+        self.assertEqual(method.requested, [1, 2, 3, 4])
+
+    def test_declared_page_size_is_trusted(self):
+        method = listing(range(3), cap=10)
+        method.per_page_honoured = 10
+        self.assertEqual(list(Cursor(method).items()), range(3))
+        self.assertEqual(method.requested, [1])
+
+    def test_parallel_pages_capped_below_the_page_size(self):
+        method = listing(range(23), cap=4)
+        pages = list(Cursor(method).pages(parallel=3))
+        self.assertEqual(sum(pages, []), range(23))
+
+    def test_streamed_pages_capped_below_the_page_size(self):
+        items = range(23)
+
+        def method(page, per_page, stream=False):
+            return items[(page - 1) * 4:page * 4]
+        method.pagination_mode = 'page'
+        method.max_per_page = 10
+        self.assertEqual(list(Cursor(method).items(stream=True)), items)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import threading
+import time
+import unittest
+
+from assembla.error import AssemblaError
+from assembla.HttpClient import HttpClient
+from assembla.metrics import Metrics
+
+
+class Response(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = ''
+
+
+class Token(object):
+
+    def __init__(self, access_token, expires_in=None):
+        self.content = {'access_token': access_token,
+                'refresh_token': 'refresh2', 'expires_in': expires_in}
+
+
+class Session(object):
+    """
+    Answers with the queued statuses (then 200), or 401 to any request
+    still using a token in `stale`. Records the tokens sent.
+    """
+
+    def __init__(self, *statuses, **kargs):
+        self.statuses = list(statuses)
+        self.stale = kargs.get('stale', ())
+        self.tokens = []
+        self.headers = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, **kargs):
+        token = kargs['headers']['Authorization']
+        with self.lock:
+            self.tokens.append(token)
+            if token in self.stale:
+                status = 401
+            else:
+                status = self.statuses.pop(0) if self.statuses else 200
+        if isinstance(status, Exception):
+            raise status
+        return Response(*status) if isinstance(status, tuple) \
+                else Response(status)
+
+    post = get
+
+
+class Body(object):
+    """Streamed request body, rewindable when `rewinds` is given"""
+
+    def __init__(self, rewinds=None):
+        if rewinds is not None:
+            self.rewound = 0
+            self.rewind = self._rewind
+
+    def read(self, size=-1):
+        return ''
+
+    def _rewind(self):
+        self.rewound += 1
+        return True
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def client(self, *statuses, **kargs):
+        kargs.setdefault('retry_delay', 0)
+        client = HttpClient('key', 'secret', metrics=Metrics(), **kargs)
+        client.initTokens('token1', 'refresh1')
+        client.client = self.session = Session(*statuses)
+        self.refreshes = []
+
+        def get_access_token(method, data):
+            self.refreshes.append(data['refresh_token'])
+            time.sleep(0.05)
+            return Token('token%d' % (len(self.refreshes) + 1))
+        client.service.get_access_token = get_access_token
+        return client
+
+    def test_server_errors_are_retried(self):
+        client = self.client(503, 502)
+        self.assertEqual(client.GET('http://x/').status_code, 200)
+        self.assertEqual(len(self.session.tokens), 3)
+
+    def test_retries_are_bounded(self):
+        client = self.client(503, 503, 503, retry_count=2)
+        self.assertEqual(client.GET('http://x/').status_code, 503)
+        self.assertEqual(len(self.session.tokens), 3)
+
+    def test_per_request_retry_count(self):
+        client = self.client(503, 503, retry_count=3)
+        self.assertEqual(client.GET('http://x/', retry_count=0).status_code,
+                503)
+        self.assertEqual(len(self.session.tokens), 1)
+
+    def test_client_errors_are_not_retried(self):
+        client = self.client(404)
+        self.assertEqual(client.GET('http://x/').status_code, 404)
+        self.assertEqual(len(self.session.tokens), 1)
+
+    def test_throttled_requests_wait_and_retry(self):
+        client = self.client((429, {'retry-after': '0'}))
+        self.assertEqual(client.GET('http://x/').status_code, 200)
+        self.assertEqual(len(self.session.tokens), 2)
+
+    def test_unauthorized_refreshes_the_token(self):
+        client = self.client(401)
+        self.assertEqual(client.GET('http://x/').status_code, 200)
+        self.assertEqual(self.refreshes, ['refresh1'])
+        self.assertEqual(self.session.tokens,
+                ['Bearer token1', 'Bearer token2'])
+
+    def test_concurrent_unauthorized_refresh_once(self):
+        client = self.client()
+        client.client.stale = ('Bearer token1',)
+        statuses = []
+
+        def get():
+            statuses.append(client.GET('http://x/').status_code)
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.refreshes, ['refresh1'])
+        self.assertEqual(statuses, [200] * 8)
+
+    def test_expiring_token_is_refreshed_first(self):
+        client = self.client()
+        client.initTokens('token1', 'refresh1', expires_in=30)
+        client.GET('http://x/')
+        self.assertEqual(self.refreshes, ['refresh1'])
+        self.assertEqual(self.session.tokens, ['Bearer token2'])
+
+    def test_streamed_body_is_sent_once(self):
+        client = self.client(503)
+        response = client.POST('http://x/', data=Body())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.session.tokens), 1)
+
+    def test_rewindable_body_is_retried(self):
+        client = self.client(503, 401)
+        body = Body(rewinds=True)
+        self.assertEqual(client.POST('http://x/', data=body).status_code,
+                200)
+        self.assertEqual(body.rewound, 2)
+        self.assertEqual(self.session.tokens[-1], 'Bearer token2')
+
+    def test_connection_errors_raise(self):
+        client = self.client(IOError('refused'))
+        self.assertRaises(AssemblaError, client.GET, 'http://x/')
+
+
+if __name__ == '__main__':
+    unittest.main()
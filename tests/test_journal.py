@@ -0,0 +1,93 @@
+import unittest
+
+import actions
+from journal import Journal, JournalError
+
+
+class Space(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Source(object):
+    """Stands in for SourceTickets, records the numbers asked for"""
+
+    def __init__(self):
+        self.asked = None
+
+    def iter(self, numbers):
+        self.asked = list(numbers)
+        return iter(self.asked)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = Journal(':memory:', 'job')
+
+    def test_units_and_values(self):
+        self.assertFalse(self.journal.done('ticket', 5))
+        self.journal.record('ticket', 5, ['old', 'new', 7])
+        self.assertTrue(self.journal.done('ticket', 5))
+        self.assertEqual(self.journal.get('ticket', 5), ['old', 'new', 7])
+        self.assertEqual(self.journal.items('ticket'),
+                [('5', ['old', 'new', 7])])
+
+    def test_maps_keep_their_keys(self):
+        self.journal.record_map('number_map', {1: 10, 2: 11})
+        self.assertEqual(self.journal.get_map('number_map'), {1: 10, 2: 11})
+        self.assertEqual(self.journal.get_map('milestone_map'), None)
+
+    def test_jobs_are_kept_apart(self):
+        self.journal.record('ticket_done', 1)
+        other = Journal.for_spaces(':memory:', Space('a'), Space('b'), 'web')
+        self.assertEqual(other.job, 'a:b:web')
+        self.assertFalse(other.done('ticket_done', 1))
+
+    def test_same_options_resume(self):
+        self.journal.check_options(tickets=[1, 2], renumber=False)
+        self.journal.record('ticket_done', 1)
+        self.journal.check_options(tickets=[1, 2], renumber=False)
+        self.assertTrue(self.journal.done('ticket_done', 1))
+
+    def test_other_options_are_refused(self):
+        self.journal.check_options(tickets=[1, 2], renumber=False)
+        self.journal.record_map('number_map', {1: 1, 2: 2})
+        self.assertRaises(JournalError, self.journal.check_options,
+                tickets=[1, 2, 3], renumber=False)
+        self.assertRaises(JournalError, self.journal.check_options,
+                tickets=[1, 2], renumber=True)
+
+    def test_progress_without_options_is_refused(self):
+        self.journal.record('ticket_done', 1)
+        self.assertRaises(JournalError, self.journal.check_options,
+                tickets='all', renumber=False)
+
+    def test_reset_starts_over(self):
+        self.journal.check_options(tickets=[1], renumber=False)
+        self.journal.record('ticket_done', 1)
+        self.journal.reset()
+        self.assertEqual(self.journal.units(), 0)
+        self.journal.check_options(tickets=[1, 2], renumber=True)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def test_finished_tickets_are_skipped(self):
+        journal = Journal(':memory:', 'job')
+        journal.record('ticket_done', 2)
+        journal.record('ticket_done', 3)
+        source = Source()
+        tickets = actions.pending_tickets(source, {1: 1, 2: 2, 3: 3, 4: 4},
+                journal)
+        self.assertEqual(list(tickets), [1, 4])
+
+    def test_without_journal_every_ticket_is_pending(self):
+        source = Source()
+        actions.pending_tickets(source, {3: 3, 1: 1})
+        self.assertEqual(source.asked, [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import cgi
+import unittest
+from StringIO import StringIO
+
+from assembla.multipart import MultipartEncoder, FileChunks
+
+
+CONTENT = 'binary\r\n--4079f\x00\xff' * 1000
+
+
+class Source(object):
+    """File-like content counting how often it is opened and closed"""
+
+    opened = 0
+    closed = 0
+
+    def __init__(self, content=CONTENT):
+        Source.opened += 1
+        self.file = StringIO(content)
+
+    def read(self, size):
+        return self.file.read(size)
+
+    def close(self):
+        Source.closed += 1
+
+
+def encoder(size=len(CONTENT), reopen=None):
+    return MultipartEncoder('document[file]', 'report.bin',
+            FileChunks(Source()), [('document[name]', 'Report'),
+            ('document[description]', u'caf\xe9')], size, reopen)
+
+
+def parse(body):
+    fields = cgi.parse_multipart(StringIO(body),
+            {'boundary': MultipartEncoder.BOUNDARY})
+    return dict((k, v[0]) for k, v in fields.items())
+
+
+class MultipartEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        Source.opened = Source.closed = 0
+
+    def test_body_parses_back(self):
+        fields = parse(''.join(encoder()))
+        self.assertEqual(fields['document[file]'], CONTENT)
+        self.assertEqual(fields['document[name]'], 'Report')
+        self.assertEqual(fields['document[description]'], 'caf\xc3\xa9')
+
+    def test_length_matches_the_body(self):
+        body = encoder()
+        self.assertEqual(body.len, len(''.join(body)))
+
+    def test_unknown_size_has_no_length(self):
+        self.assertFalse(hasattr(encoder(size=None), 'len'))
+
+    def test_read_in_pieces(self):
+        expected = ''.join(encoder())
+        body = encoder()
+        pieces = []
+        while True:
+            piece = body.read(1000)
+            if not piece:
+                break
+            self.assertTrue(len(piece) <= 1000)
+            pieces.append(piece)
+        self.assertEqual(''.join(pieces), expected)
+
+    def test_unsent_body_rewinds(self):
+        self.assertTrue(encoder().rewind())
+
+    def test_sent_body_without_reopen_cannot_rewind(self):
+        body = encoder()
+        body.read(10)
+        self.assertFalse(body.rewind())
+
+    def test_rewind_reopens_the_source(self):
+        body = encoder(reopen=lambda: FileChunks(Source()))
+        first = body.read()
+        self.assertTrue(body.rewind())
+        self.assertEqual(body.read(), first)
+        self.assertEqual((Source.opened, Source.closed), (2, 1))
+        body.close()
+        self.assertEqual(Source.closed, 2)
+
+    def test_failed_reopen_cannot_rewind(self):
+        def reopen():
+            raise IOError('gone')
+        body = encoder(reopen=reopen)
+        body.read()
+        self.assertFalse(body.rewind())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import unittest
+
+from assembla.compact import CompactModelFactory
+from assembla.error import AssemblaError
+from assembla.parsers import JSONArrayReader, ModelParser
+
+
+DOCUMENTS = [
+    '[]',
+    ' [ ] ',
+    '[1, 2.5, "three", true, null]',
+    '[{"id": 1, "comment": "a, [b] {c}"}, {"id": 2}]',
+    '[{"text": "quote \\" and backslash \\\\"}, "\\\\", "\\"]"]',
+    '[{"unicode": "\\u00e9\\u263a", "nested": [[1, [2]], {"a": {"b": []}}]}]',
+    '\n[\n  {"id": 1},\n  {"id": 2}\n]\n',
+]
+
+
+def read(chunks):
+    reader = JSONArrayReader(chunks, json.loads)
+    return list(reader), reader.document
+
+
+def splits(document):
+    """The document cut in two at every position"""
+    for i in range(len(document) + 1):
+        yield [document[:i], document[i:]]
+
+
+class JSONArrayReaderTest(unittest.TestCase):
+
+    def test_whole_document(self):
+        for document in DOCUMENTS:
+            self.assertEqual(read([document]), (json.loads(document), None))
+
+    def test_every_chunk_boundary(self):
+        for document in DOCUMENTS:
+            expected = json.loads(document)
+            for chunks in splits(document):
+                self.assertEqual(read(chunks)[0], expected, chunks)
+
+    def test_single_character_chunks(self):
+        for document in DOCUMENTS:
+            self.assertEqual(read(list(document))[0], json.loads(document))
+
+    def test_elements_are_yielded_before_the_end(self):
+        def chunks():
+            yield '[{"id": 1}, '
+            raise AssertionError('read past the first element')
+        self.assertEqual(iter(JSONArrayReader(chunks(), json.loads)).next(),
+                {'id': 1})
+
+    def test_other_documents_are_decoded_whole(self):
+        for chunks in splits('{"error": "not found"}'):
+            self.assertEqual(read(chunks), ([], {'error': 'not found'}))
+
+    def test_empty_body(self):
+        self.assertEqual(read(['', '  ']), ([], None))
+
+    def test_truncated_array(self):
+        self.assertRaises(ValueError, read, ['[{"id": 1}, {"id"'])
+
+
+class Method(object):
+
+    api = None
+    payload_type = 'ticketcomment'
+    payload_list = True
+    parameters = {}
+
+
+class ModelParserTest(unittest.TestCase):
+
+    def test_stream_skips_null_elements_like_a_whole_list(self):
+        document = '[{"id": 1}, null, {}, {"id": 2}]'
+        parser = ModelParser()
+        streamed = list(parser.parse_stream(Method(), iter([document])))
+        parsed = parser.parse(Method(), document)
+        self.assertEqual([c.id for c in streamed], [1, 2])
+        self.assertEqual([c.id for c in parsed], [1, 2])
+
+    def test_compact_models_are_not_parsed_lazily(self):
+        self.assertRaises(AssemblaError, ModelParser, lazy=True,
+                model_factory=CompactModelFactory)
+        ModelParser(model_factory=CompactModelFactory)
+        ModelParser(lazy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+from email.utils import formatdate
+
+from assembla import ratelimit
+from assembla.ratelimit import RateLimiter, parse_retry_after, backoff
+
+
+class Clock(object):
+    """Stands in for the time module, sleeping only moves the clock"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        # like a real sleep, never shorter than the clock resolution
+        self.now += max(seconds, 1e-6)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time, ratelimit.time = ratelimit.time, self.clock
+
+    def tearDown(self):
+        ratelimit.time = self.time
+
+    def test_no_rate_never_waits(self):
+        limiter = RateLimiter()
+        for i in range(100):
+            limiter.acquire()
+        self.assertEqual(self.clock.slept, [])
+
+    def test_burst_then_paced(self):
+        limiter = RateLimiter(rate=10, burst=5)
+        for i in range(5):
+            limiter.acquire()
+        self.assertEqual(self.clock.slept, [])
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 0.1)
+        for i in range(10):
+            limiter.acquire()
+        self.assertAlmostEqual(self.clock.now - 1000.0, 1.1)
+
+    def test_tokens_refill_up_to_burst(self):
+        limiter = RateLimiter(rate=10, burst=5)
+        for i in range(5):
+            limiter.acquire()
+        self.clock.now += 60
+        for i in range(5):
+            limiter.acquire()
+        self.assertEqual(self.clock.slept, [])
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 0.1)
+
+    def test_throttling_halves_the_rate(self):
+        limiter = RateLimiter(rate=8, min_rate=3)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 4)
+        self.assertTrue(limiter.tokens <= 0)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 3)
+
+    def test_successes_restore_the_rate(self):
+        limiter = RateLimiter(rate=10)
+        limiter.throttled()
+        limiter.succeeded()
+        self.assertEqual(limiter.rate, 6)
+        for i in range(10):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 10)
+
+    def test_retry_after_pauses_every_caller(self):
+        limiter = RateLimiter()
+        limiter.throttled(retry_after=2)
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 2)
+
+    def test_exhausted_rate_limit_pauses_until_reset(self):
+        limiter = RateLimiter()
+        limiter.update({'x-ratelimit-remaining': '5',
+                'x-ratelimit-reset': '30'})
+        limiter.acquire()
+        self.assertEqual(self.clock.slept, [])
+        limiter.update({'x-ratelimit-remaining': '0',
+                'x-ratelimit-reset': '30'})
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 30)
+
+    def test_reset_as_epoch_timestamp(self):
+        self.clock.now = 1.5e9
+        limiter = RateLimiter()
+        limiter.update({'x-ratelimit-remaining': '0',
+                'x-ratelimit-reset': str(1.5e9 + 12)})
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 12)
+
+
+class RetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('120'), 120.0)
+        self.assertEqual(parse_retry_after('-3'), 0.0)
+
+    def test_http_date(self):
+        import time
+        seconds = parse_retry_after(formatdate(time.time() + 60))
+        self.assertTrue(55 < seconds <= 60, seconds)
+
+    def test_missing_or_invalid(self):
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after('soon'), None)
+
+    def test_backoff_is_jittered_and_capped(self):
+        for attempt in range(10):
+            delay = backoff(attempt, 1, cap=30)
+            self.assertTrue(0 <= delay <= min(30, 2 ** attempt))
+
+
+if __name__ == '__main__':
+    unittest.main()
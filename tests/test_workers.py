@@ -0,0 +1,32 @@
+import threading
+import unittest
+
+from assembla.workers import WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_jobs_run_on_the_workers(self):
+        with WorkerPool(4) as pool:
+            names = [f.result() for f in [pool.submit(
+                    lambda: threading.current_thread().name)
+                    for i in range(8)]]
+        self.assertTrue(all(n.startswith('ATMT-worker-') for n in names))
+
+    def test_jobs_waiting_on_jobs_do_not_deadlock(self):
+        pool = WorkerPool(2)
+
+        def outer(n):
+            # every worker busy here, nested jobs run inline
+            return sum(f.result() for f in
+                    [pool.submit(lambda i=i: i) for i in range(n)])
+        futures = [pool.submit(outer, n) for n in range(6)]
+        done = [f.wait(5) for f in futures]
+        pool.shutdown(wait=False)
+        self.assertEqual(done, [True] * 6)
+        self.assertEqual([f.result() for f in futures],
+                [0, 0, 1, 3, 6, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()